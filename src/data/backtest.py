@@ -0,0 +1,191 @@
+# Replays the projections at past origins and measures their forecast errors
+# Each origin is an independent unit of work: the observed series are cut at the origin,
+# the Focus expectations are rebuilt as they were known then from the vintage store,
+# and the projections are compared with what was observed afterwards
+# Import libraries
+import warnings
+import os
+import time
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import build_features
+import extract_data_olinda
+import make_dataset
+import storage
+
+warnings.filterwarnings("ignore")
+
+# Indicator -> (observed extraction, Focus key or None, output column)
+# Observed series are read from the extraction outputs kept by the pipeline under interim/stages
+INDICATORS = {
+    'gdp': ('ibge_gdp', 'gdp', 'gdp'),
+    'household_consumption': ('ibge_household_consumption', 'household_consumption', 'household_consumption'),
+    'industrial_gdp': ('ibge_industrial_gdp', 'industrial_gdp', 'industrial_gdp'),
+    'unemployment': ('ibge_unemployment_rate', 'unemployment', 'unemployment_rate'),
+    'ipca': ('ibge_ipca', 'ipca', 'ipca'),  # monthly index, scored at the quarter-end months
+    'commerce_gdp': ('ibge_trade_gdp', None, 'trade_gdp'),
+}
+
+# Set in every worker by _init_worker: read-only inputs shared by all the origins it runs
+_shared = {}
+
+
+def _init_worker(path_data, observed, release_lag, arima_order, scratch):
+    warnings.filterwarnings("ignore")
+    _shared.update(
+        path_data=path_data, observed=observed, release_lag=release_lag, arima_order=arima_order,
+        scratch=scratch,
+    )
+
+
+def _project(indicator, scratch, observed, as_of):
+    """
+    Runs the projection of `indicator` with the data available at the origin.
+    Outputs are written under `scratch`, so the real interim layer is never touched.
+    """
+    _, focus_key, _ = INDICATORS[indicator]
+    if indicator == 'commerce_gdp':
+        lags, order, average = _shared['arima_order']
+        return make_dataset.arima_comercio(scratch, lags, order, average, df_observed=observed)
+    expected = extract_data_olinda.get_focus_as_of(_shared['path_data'], focus_key, as_of)
+    func, _ = build_features.PROJECTIONS[indicator]
+    return func(scratch, df_observed=observed, df_expected=expected)
+
+
+def _run_origin(origin, indicators, horizons):
+    """
+    Replays the projections at one origin and returns the forecast errors. Runs in a worker process.
+    """
+    scratch = os.path.join(_shared['scratch'], f'{origin:%Y%m%d}')
+    os.makedirs(os.path.join(scratch, 'interim'), exist_ok=True)
+    as_of = origin + pd.DateOffset(months=_shared['release_lag'])
+    targets = [origin + pd.DateOffset(months=3 * h) for h in range(1, horizons + 1)]
+
+    rows = []
+    try:
+        for indicator in indicators:
+            extraction, _, column = INDICATORS[indicator]
+            full = _shared['observed'][extraction][column]
+            started = time.perf_counter()
+            try:
+                projected = _project(indicator, scratch, full.loc[:origin].to_frame(), as_of)[column]
+                error = None
+            except Exception as e:  # an origin without enough data is reported, not fatal
+                projected, error = pd.Series(dtype=float), str(e)
+            seconds = time.perf_counter() - started
+
+            for horizon, target in enumerate(targets, start=1):
+                rows.append({
+                    'origin': origin, 'indicator': indicator, 'horizon': horizon, 'target': target,
+                    'forecast': projected.get(target, np.nan), 'actual': full.get(target, np.nan),
+                    'seconds': seconds, 'error': error,
+                })
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    return rows
+
+
+def summarize(errors):
+    """
+    Aggregates backtest errors per indicator and horizon.
+
+    Parameters:
+    - errors (pd.DataFrame): Output of run_backtest.
+
+    Returns:
+    - pd.DataFrame indexed by (indicator, horizon) with n, bias, mae, rmse and mape (%).
+    """
+    scored = errors.dropna(subset=['forecast', 'actual']).assign(
+        diff=lambda df: df['forecast'] - df['actual'],
+    )
+    scored['abs_diff'] = scored['diff'].abs()
+    scored['sq_diff'] = scored['diff'] ** 2
+    scored['ape'] = 100 * scored['abs_diff'] / scored['actual'].abs().replace(0, np.nan)
+    summary = scored.groupby(['indicator', 'horizon']).agg(
+        n=('diff', 'size'), bias=('diff', 'mean'), mae=('abs_diff', 'mean'),
+        rmse=('sq_diff', 'mean'), mape=('ape', 'mean'),
+    )
+    summary['rmse'] = np.sqrt(summary['rmse'])
+    return summary
+
+
+def run_backtest(path_data, origins=None, horizons=8, indicators=None, release_lag=3,
+                 arima_order=(1, 1, 1), max_workers=None, download_history=True):
+    """
+    Replays the projections at many past origins across a process pool and measures their errors.
+
+    At each origin the observed series are cut at the origin quarter and the Focus expectations
+    are those known `release_lag` months later (when that quarter is published), taken from the
+    vintage store. The store is first seeded with the full Focus history of every indicator
+    (extract_data_olinda.seed_vintages). The observed series are loaded once and shared with
+    every worker.
+
+    Parameters:
+    - path_data (str): Base data path. The extractions of a previous make_dataset run
+      (interim/stages) and the Focus vintage store are read from it.
+    - origins (list): Origin quarters (yyyy-mm-01, last month of the quarter). Defaults to every
+      observed GDP quarter from 2016 on that still has at least one quarter to compare with.
+    - horizons (int): Number of quarters scored after each origin.
+    - indicators (list): Keys of INDICATORS. Defaults to all of them.
+    - release_lag (int): Months between an origin and the expectations used for it.
+    - arima_order (tuple): (p, d, q) of the commerce GDP model.
+    - max_workers (int): Worker processes. Defaults to the number of CPUs.
+    - download_history (bool): Download (or extend) the Focus history before seeding the store;
+      with False, only the history pages already on disk are used.
+
+    Returns:
+    - pd.DataFrame with one row per origin, indicator and horizon (origin, indicator, horizon,
+      target, forecast, actual, seconds, error). Aggregate it with summarize.
+      The errors and their summary are also saved to interim/backtest-errors and
+      interim/backtest-summary; attrs['wall_seconds'] holds the duration of the run.
+
+    Raises:
+    - RuntimeError when an indicator got no forecast at any origin (e.g. no Focus history).
+    """
+    indicators = list(INDICATORS) if indicators is None else list(indicators)
+    stages_dir = os.path.join(path_data, 'interim', 'stages')
+    observed = {
+        INDICATORS[name][0]: storage.load_frame(os.path.join(stages_dir, INDICATORS[name][0]), memory_map=False)
+        for name in indicators
+    }
+
+    if origins is None:
+        quarters = observed.get('ibge_gdp', next(iter(observed.values()))).index
+        origins = quarters[(quarters >= '2016-01-01') & (quarters < quarters[-1])]
+    origins = [pd.Timestamp(origin) for origin in origins]
+
+    sources = {extract_data_olinda.focus_source(INDICATORS[name][1]) for name in indicators if INDICATORS[name][1]}
+    for endpoint, name in sorted(sources):
+        extract_data_olinda.seed_vintages(path_data, endpoint, name, download=download_history)
+
+    started = time.perf_counter()
+    # Scratch outputs of every origin; the directory is removed when the pool is done
+    with tempfile.TemporaryDirectory(prefix='backtest-') as scratch, ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker,
+        initargs=(path_data, observed, release_lag, tuple(arima_order), scratch),
+    ) as executor:
+        chunks = executor.map(
+            _run_origin, origins, [indicators] * len(origins), [horizons] * len(origins),
+            chunksize=max(1, len(origins) // (4 * (max_workers or os.cpu_count() or 1))),
+        )
+        errors = pd.DataFrame(
+            [row for chunk in chunks for row in chunk],
+            columns=['origin', 'indicator', 'horizon', 'target', 'forecast', 'actual', 'seconds', 'error'],
+        )
+
+    storage.save_frame(errors, os.path.join(path_data, 'interim', 'backtest-errors'))
+    storage.save_frame(summarize(errors), os.path.join(path_data, 'interim', 'backtest-summary'))
+    errors.attrs['wall_seconds'] = time.perf_counter() - started
+
+    # Every indicator must be forecast at some origin; otherwise its inputs are missing
+    forecast = errors.groupby('indicator')['forecast'].count().reindex(indicators, fill_value=0)
+    if len(origins) and (forecast == 0).any():
+        failures = {
+            name: errors.loc[errors['indicator'] == name, 'error'].dropna().iloc[:1].tolist()
+            for name in forecast.index[forecast == 0]
+        }
+        raise RuntimeError(f"No forecasts at any origin for {failures} (first error of each indicator).")
+    return errors
@@ -0,0 +1,516 @@
+# Offline benchmark of the pipeline
+# A local HTTP stand-in serves recorded or synthetic SIDRA, Olinda and SGS payloads, so the
+# timings measure our own parsing, projection, modelling and joins instead of the APIs' latency
+# Import libraries
+import warnings
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from functools import partial
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+import numpy as np
+import pandas as pd
+import sidrapy.resources.handler as sidra_handler
+import build_features
+import extract_data_bacen
+import extract_data_olinda
+import extract_data_sidra
+import http_session
+import make_dataset
+import response_cache
+import storage
+
+warnings.filterwarnings("ignore")
+
+# Bounds of the synthetic histories, within what pandas timestamps and date offsets can represent
+# (nanosecond spans of about 292 years); longer histories are clipped
+FIRST_DAY = pd.Timestamp('1750-01-01')
+LAST_DAY = pd.Timestamp('2261-12-01')
+
+# SIDRA table -> (frequency, start of today's history, whether the parser anchors it at the start)
+SIDRA_TABLES = {
+    '1621': ('Q', '1996-03-01', False),
+    '4099': ('Q', '2012-03-01', False),
+    '1737': ('M', '1979-12-01', True),  # the IPCA parser numbers months from Jan/1980
+    '8881': ('M', '2003-01-01', True),
+}
+
+# SGS series -> (frequency, start of today's history)
+SGS_SERIES = {
+    432: ('B', '2014-01-01'),
+    20633: ('MS', '2010-01-01'),
+    20632: ('MS', '2010-01-01'),
+    22023: ('MS', '2010-01-01'),
+}
+
+# Olinda endpoint -> (indicators, reference format, number of reference periods)
+OLINDA_ENDPOINTS = {
+    'ExpectativasMercadoTrimestrais': (['PIB Total', 'Taxa de desocupação'], 'quarter', 8),
+    'ExpectativasMercadoAnuais': (
+        ['PIB Despesa de consumo das famílias', 'PIB Indústria', 'PIB Serviços'], 'year', 5,
+    ),
+    'ExpectativaMercadoMensais': (['IPCA'], 'month', 18),
+    'ExpectativasMercadoSelic': (['Selic'], 'meeting', 16),
+}
+
+# Business days of surveys in today's Olinda answers
+OLINDA_SURVEY_DAYS = 30
+
+
+#-----------------------
+# Synthetic payloads
+
+def _history(freq, start, scale, anchored=False):
+    """
+    Dates of a synthetic history `scale` times longer than today's, which starts at `start`.
+    Histories end today and grow backwards, or start at `start` and grow forwards when `anchored`.
+    """
+    today = pd.Timestamp.today().normalize()
+    base = pd.date_range(start, today, freq=freq)
+    n = int(len(base) * scale)
+    if anchored:
+        limit = len(pd.date_range(start, LAST_DAY, freq=freq))
+        return pd.date_range(start, periods=min(n, limit), freq=freq)
+    limit = len(pd.date_range(FIRST_DAY, base[-1], freq=freq))
+    return pd.date_range(end=base[-1], periods=min(n, limit), freq=freq)
+
+
+def _walk(n, seed, level=100.0):
+    rng = np.random.default_rng(seed)
+    return level * np.cumprod(1 + rng.normal(0.002, 0.01, n))
+
+
+class SyntheticSource:
+    """
+    Generates payloads shaped like the SIDRA, Olinda and SGS answers used by the extractors,
+    with histories `scale` times longer than today's.
+    """
+
+    def __init__(self, scale=1, seed=0):
+        self.scale = scale
+        self.seed = seed
+        self._olinda = {}
+        self._histories = {}
+
+    def _dates(self, freq, start, anchored=False):
+        # Generating long histories is slow; keep them so the timings measure the pipeline
+        key = (freq, start, anchored)
+        if key not in self._histories:
+            self._histories[key] = _history(freq, start, self.scale, anchored)
+        return self._histories[key]
+
+    def sidra(self, path):
+        """
+        Rows of a SIDRA /values query (header='n'), as sidrapy returns them with format='list'.
+        """
+        parts = path.strip('/').split('/')
+        table = parts[parts.index('t') + 1]
+        categories = [None]
+        for i, part in enumerate(parts):
+            if re.fullmatch(r'c\d+', part):
+                categories = parts[i + 1].split(',')
+        freq, start, anchored = SIDRA_TABLES[table]
+        dates = self._dates('QS-DEC' if freq == 'Q' else 'MS', start, anchored)
+        if freq == 'Q':
+            codes = [f'{d.year}{(d.month - 1) // 3 + 1:02d}' for d in dates]
+        else:
+            codes = [f'{d.year}{d.month:02d}' for d in dates]
+
+        rows = []
+        for k, category in enumerate(categories):
+            values = _walk(len(codes), self.seed + k)
+            for code, value in zip(codes, values):
+                row = {'NC': '1', 'NN': 'Brasil', 'V': f'{value:.2f}', 'D1C': '1', 'D1N': 'Brasil',
+                       'D2C': code, 'D2N': code, 'D3C': table, 'D3N': table}
+                if category is not None:
+                    row.update(D4C=category, D4N=category)
+                rows.append(row)
+        return rows
+
+    def sgs(self, code, start='', end=''):
+        """
+        CSV of an SGS series between `start` and `end` (dd/mm/yyyy, '' for open), or None when empty.
+        """
+        freq, first = SGS_SERIES.get(int(code), ('MS', '2010-01-01'))
+        dates = self._dates(freq, first)
+        values = _walk(len(dates), self.seed + int(code)) / 10
+        df = pd.DataFrame({'data': dates, 'valor': values.round(2)})
+        if start:
+            df = df[df['data'] >= pd.to_datetime(start, dayfirst=True)]
+        if end:
+            df = df[df['data'] <= pd.to_datetime(end, dayfirst=True)]
+        if df.empty:
+            return None
+        df['data'] = df['data'].dt.strftime('%d/%m/%Y')
+        return df.to_csv(sep=';', decimal=',', index=False)
+
+    def sgs_starts(self):
+        """
+        First date of each synthetic SGS history (dd/mm/yyyy), for the extractors to request all of it.
+        """
+        return {
+            code: self._dates(freq, first)[0].strftime('%d/%m/%Y')
+            for code, (freq, first) in SGS_SERIES.items()
+        }
+
+    def _olinda_frame(self, endpoint):
+        if endpoint not in self._olinda:
+            indicators, reference, periods = OLINDA_ENDPOINTS[endpoint]
+            surveys = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=OLINDA_SURVEY_DAYS * self.scale)
+            today = pd.Timestamp.today()
+            if reference == 'quarter':
+                refs = [f'{p.quarter}/{p.year}' for p in pd.period_range(today, periods=periods, freq='Q')]
+            elif reference == 'year':
+                refs = [str(today.year + i) for i in range(periods)]
+            elif reference == 'month':
+                refs = [f'{p.month:02d}/{p.year}' for p in pd.period_range(today, periods=periods, freq='M')]
+            else:
+                refs = [f'R{i % 8 + 1}/{today.year + i // 8}' for i in range(periods)]
+
+            rng = np.random.default_rng(self.seed)
+            n = len(indicators) * len(refs) * len(surveys)
+            median = rng.normal(3, 1, n).round(4)
+            self._olinda[endpoint] = pd.DataFrame({
+                'Indicador': np.repeat(indicators, len(refs) * len(surveys)),
+                'reference': np.tile(np.repeat(refs, len(surveys)), len(indicators)),
+                'Data': np.tile(surveys.strftime('%Y-%m-%d'), len(indicators) * len(refs)),
+                'Media': (median + rng.normal(0, 0.1, n)).round(4),
+                'Mediana': median,
+                'DesvioPadrao': rng.uniform(0, 1, n).round(4),
+                'Minimo': (median - 2).round(4),
+                'Maximo': (median + 2).round(4),
+                'numeroRespondentes': rng.integers(10, 120, n),
+                'baseCalculo': 0,
+            })
+        return self._olinda[endpoint]
+
+    def olinda(self, endpoint, query):
+        """
+        CSV of an Olinda OData query. Honors the indicator and survey date filters,
+        $orderby on Data, $skip, $top and $select.
+        """
+        df = self._olinda_frame(endpoint)
+        reference = 'Reuniao' if endpoint == 'ExpectativasMercadoSelic' else 'DataReferencia'
+        df = df.rename(columns={'reference': reference})
+
+        condition = query.get('$filter', [''])[0]
+        names = re.findall(r"Indicador eq '([^']+)'", condition)
+        if names:
+            df = df[df['Indicador'].isin(names)]
+        since = re.search(r"Data ge '([\d-]+)'", condition)
+        if since:
+            df = df[df['Data'] >= since.group(1)]
+        if 'Data desc' in query.get('$orderby', [''])[0]:
+            df = df.sort_values('Data', ascending=False, kind='stable')
+        else:
+            df = df.sort_values(['Data', reference], kind='stable')
+        skip = int(query.get('$skip', [0])[0])
+        top = int(query.get('$top', [len(df)])[0])
+        df = df.iloc[skip:skip + top]
+        select = query.get('$select', [None])[0]
+        if select:
+            df = df[select.split(',')]
+        return df.to_csv(index=False, decimal=',')
+
+
+#-----------------------
+# Local stand-in server
+
+class StandIn:
+    """
+    Local HTTP server answering SIDRA (/sidra), Olinda (/olinda) and SGS (/sgs) requests.
+
+    Recorded payloads take precedence over synthetic ones: a request is answered with
+    {recorded_dir}/{source}/{sha256 of its path and query} when that file exists.
+
+    Used as a context manager, it points sidrapy and the extractors at itself, moves the
+    extractors' SGS start dates and Focus survey window back so the whole scaled history is
+    requested, and restores the real settings on exit.
+
+    Answers are rendered once per path and kept, so only the first request of a path pays for
+    generating its payload.
+
+    Parameters:
+    - source (SyntheticSource): Generator of the synthetic payloads.
+    - recorded_dir (str): Directory with recorded payloads.
+    """
+
+    def __init__(self, source=None, recorded_dir=None):
+        self.source = source or SyntheticSource()
+        self.recorded_dir = recorded_dir
+        self.requests = 0
+        self._answers = {}
+        self._server = None
+        self._saved = None
+
+    @staticmethod
+    def recording_path(recorded_dir, source, path):
+        """
+        File under which the answer to `path` (path and query, without the host) is recorded.
+        """
+        return os.path.join(recorded_dir, source, hashlib.sha256(path.encode('utf-8')).hexdigest())
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def answer(self, path):
+        """
+        Returns (status, content type, body bytes) for a request path.
+        """
+        self.requests += 1
+        if path not in self._answers:
+            self._answers[path] = self._render(path)
+        return self._answers[path]
+
+    def _render(self, path):
+        parts = urlsplit(path)
+        source = parts.path.strip('/').split('/')[0]
+        if self.recorded_dir:
+            recorded = self.recording_path(self.recorded_dir, source, path)
+            if os.path.exists(recorded):
+                with open(recorded, 'rb') as f:
+                    return 200, 'text/plain', f.read()
+
+        query = parse_qs(parts.query, keep_blank_values=True)
+        if source == 'sidra':
+            return 200, 'application/json', json.dumps(self.source.sidra(parts.path)).encode('utf-8')
+        if source == 'olinda':
+            endpoint = parts.path.rstrip('/').split('/')[-1]
+            return 200, 'text/csv; charset=utf-8', self.source.olinda(endpoint, query).encode('utf-8')
+        if source == 'sgs':
+            code = re.search(r'bcdata\.sgs\.(\d+)', parts.path).group(1)
+            text = self.source.sgs(code, query.get('dataInicial', [''])[0], query.get('dataFinal', [''])[0])
+            if text is None:
+                return 404, 'text/plain', b'[]'
+            return 200, 'text/csv; charset=utf-8', text.encode('utf-8')
+        return 404, 'text/plain', b''
+
+    def start(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, content_type, body = stand_in.answer(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        self._saved = (
+            sidra_handler.ENDPOINT_BASE, extract_data_olinda.OLINDA_URL, extract_data_bacen.SGS_URL,
+            extract_data_bacen.SGS_START, extract_data_olinda.FOCUS_LOOKBACK_DAYS,
+        )
+        sidra_handler.ENDPOINT_BASE = f'{self.url}/sidra'
+        extract_data_olinda.OLINDA_URL = f'{self.url}/olinda/'
+        extract_data_bacen.SGS_URL = f'{self.url}/sgs/'
+        extract_data_bacen.SGS_START = {**extract_data_bacen.SGS_START, **self.source.sgs_starts()}
+        extract_data_olinda.FOCUS_LOOKBACK_DAYS = round(extract_data_olinda.FOCUS_LOOKBACK_DAYS * self.source.scale)
+        return self
+
+    def __exit__(self, *exc):
+        (sidra_handler.ENDPOINT_BASE, extract_data_olinda.OLINDA_URL, extract_data_bacen.SGS_URL,
+         extract_data_bacen.SGS_START, extract_data_olinda.FOCUS_LOOKBACK_DAYS) = self._saved
+        self.stop()
+
+
+#-----------------------
+# Benchmark
+
+def _rows(output):
+    if isinstance(output, dict):
+        return sum(len(df) for df in output.values())
+    return len(output)
+
+
+def time_stage(func, repeat=3, setup=None):
+    """
+    Calls `func` `repeat` times (after `setup`, when given) and returns (last output, seconds per call).
+    """
+    seconds = []
+    output = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        output = func()
+        seconds.append(time.perf_counter() - started)
+    return output, seconds
+
+
+def benchmark_scale(work_dir, scale, repeat=3, recorded_dir=None, arima_order=(1, 1, 1)):
+    """
+    Times every pipeline stage against a stand-in serving histories `scale` times longer than today's.
+
+    Returns:
+    - list of dicts (scale, stage, rows, min_seconds, median_seconds).
+    """
+    for layer in ('raw', 'interim', 'processed'):
+        os.makedirs(os.path.join(work_dir, layer), exist_ok=True)
+    results = []
+
+    def record(stage, func, setup=None):
+        output, seconds = time_stage(func, repeat, setup)
+        results.append({
+            'scale': scale, 'stage': stage, 'rows': _rows(output),
+            'min_seconds': min(seconds), 'median_seconds': float(np.median(seconds)),
+        })
+        return output
+
+    extractors = {
+        'extract_data_sidra.get_ibge_national_accounts': extract_data_sidra.get_ibge_national_accounts,
+        'extract_data_sidra.get_ibge_unemployment_rate': extract_data_sidra.get_ibge_unemployment_rate,
+        'extract_data_sidra.get_ibge_ipca': extract_data_sidra.get_ibge_ipca,
+        'extract_data_olinda.get_focus_quarterly': extract_data_olinda.get_focus_quarterly,
+        'extract_data_olinda.get_focus_annual': extract_data_olinda.get_focus_annual,
+        'extract_data_olinda.get_focus_ipca': extract_data_olinda.get_focus_ipca,
+        'extract_data_olinda.get_focus_selic': extract_data_olinda.get_focus_selic,
+        'extract_data_bacen.get_selic_quarterly': extract_data_bacen.get_selic_quarterly,
+    }
+    with StandIn(SyntheticSource(scale), recorded_dir):
+        # Extraction and parsing; the response caches are off so every call goes through the stand-in.
+        # One untimed pass renders every payload first, so the timings leave out their generation
+        for func in extractors.values():
+            func(work_dir)
+        outputs = {stage: record(stage, partial(func, work_dir)) for stage, func in extractors.items()}
+    accounts, unemployment, ipca, quarterly, annual, focus_ipca, focus_selic, selic = outputs.values()
+
+    inputs = {
+        'ibge_gdp': accounts['gdp'], 'focus_gdp': quarterly['gdp'],
+        'ibge_household_consumption': accounts['household_consumption'],
+        'focus_household_consumption': annual['household_consumption'],
+        'ibge_industrial_gdp': accounts['industrial_gdp'], 'focus_industrial_gdp': annual['industrial_gdp'],
+        'ibge_unemployment_rate': unemployment, 'focus_unemployment': quarterly['unemployment'],
+        'ibge_ipca': ipca, 'focus_ipca': focus_ipca,
+        'selic_quarterly': selic, 'focus_selic': focus_selic,
+    }
+
+    projections = {}
+    for name, (func, deps) in build_features.PROJECTIONS.items():
+        projections[name] = record(
+            f'build_features.{func.__name__}',
+            lambda: func(work_dir, *(inputs[dep] for dep in deps)),
+        )
+
+    models_dir = os.path.join(work_dir, 'interim', 'models')
+    lags, order, average = arima_order
+    projections['commerce_gdp'] = record(
+        'make_dataset.arima_comercio',
+        lambda: make_dataset.arima_comercio(work_dir, lags, order, average, df_observed=accounts['trade_gdp']),
+        setup=lambda: shutil.rmtree(models_dir, ignore_errors=True),  # time the fit, not the model cache
+    )
+
+    record('make_dataset.assemble_dataset', lambda: make_dataset.assemble_dataset(
+        work_dir, *(projections[name] for name in
+                    ('gdp', 'household_consumption', 'industrial_gdp', 'unemployment', 'ipca', 'selic', 'commerce_gdp'))
+    ))
+    return results
+
+
+def current_version():
+    """
+    Short hash of the checked-out commit, or 'unknown' outside a git work tree.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(results, baseline, candidate, tolerance=1.2, min_delta=0.01):
+    """
+    Lists the stages that got slower between two benchmarked versions.
+
+    Parameters:
+    - results (pd.DataFrame): Saved benchmark results.
+    - baseline, candidate (str): Versions to compare.
+    - tolerance (float): Ratio of median times above which a stage counts as a regression.
+    - min_delta (float): Seconds the median must also grow by, so that stages taking a few
+      milliseconds are not reported for noise.
+
+    Returns:
+    - pd.DataFrame with scale, stage, both medians, their ratio and difference, for the regressed stages.
+    """
+    def medians(version):
+        rows = results[results['version'] == version]
+        return rows.groupby(['scale', 'stage'])['median_seconds'].min()
+
+    table = pd.concat({'baseline': medians(baseline), 'candidate': medians(candidate)}, axis=1).dropna()
+    table['ratio'] = table['candidate'] / table['baseline']
+    table['delta'] = table['candidate'] - table['baseline']
+    return table[(table['ratio'] > tolerance) & (table['delta'] > min_delta)].reset_index()
+
+
+def run_benchmark(out_dir, scales=(1, 10, 100), repeat=3, version=None, recorded_dir=None, tolerance=1.2,
+                  min_delta=0.01):
+    """
+    Benchmarks the pipeline offline at several history scales, appends the timings to
+    {out_dir}/results and reports the stages that regressed against the previous version.
+
+    Parameters:
+    - out_dir (str): Where results are kept between versions.
+    - scales (tuple): History lengths, as multiples of today's.
+    - repeat (int): Calls per stage; the minimum and median times are kept.
+    - version (str): Label of the code being measured. Defaults to the current git commit.
+    - recorded_dir (str): Recorded payloads served instead of synthetic ones (see StandIn).
+    - tolerance (float): Slowdown ratio reported as a regression.
+    - min_delta (float): Slowdown in seconds a stage must also exceed to be reported.
+
+    Returns:
+    - (results, regressions): the timings of this run, and compare() against the previous version.
+    """
+    version = version or current_version()
+    saved_cache, saved_http_dir = response_cache.CACHE, http_session.CACHE_DIR
+    response_cache.configure(None)
+    http_session.set_cache_dir(None)
+    rows = []
+    try:
+        for scale in scales:
+            work_dir = tempfile.mkdtemp(prefix=f'benchmark-{scale}x-')
+            try:
+                rows += benchmark_scale(work_dir, scale, repeat, recorded_dir)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        response_cache.CACHE = saved_cache
+        http_session.CACHE_DIR = saved_http_dir
+
+    results = pd.DataFrame(rows).assign(version=version, run_at=pd.Timestamp.now())
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, 'results')
+    history = storage.load_frame(path, memory_map=False) if storage.find_frame(path) else results.iloc[0:0]
+    history = pd.concat([history[history['version'] != version], results], ignore_index=True)
+    storage.save_frame(history, path)
+
+    previous = history.loc[history['version'] != version].sort_values('run_at')['version']
+    regressions = compare(history, previous.iloc[-1], version, tolerance, min_delta) if len(previous) else pd.DataFrame()
+    for row in regressions.itertuples():
+        print(f"Regression at {row.scale}x in {row.stage}: {row.baseline:.3f}s -> {row.candidate:.3f}s")
+    return results, regressions
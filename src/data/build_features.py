@@ -6,51 +6,114 @@ import numpy as np
 import extract_data_bacen
 import extract_data_olinda
 import extract_data_sidra
+import storage
 
 
 warnings.filterwarnings("ignore")
 
-def project_gdp(path_data):
+def compound_projection(values, expectations, lag):
+    """
+    Fills missing values with the rule base * (1 + expectation / 100), where the base
+    is the value `lag` periods earlier (4 for quarterly year-over-year, 1 for monthly).
+
+    Projected values become the base for later periods, so whole horizons are filled at once:
+    each chain is the last observed value times the cumulative product of growth factors.
+    A missing expectation (or a missing base) breaks the chain until the next observed value.
+    Works along the last axis, so leading dimensions (e.g. simulated draws) are supported.
+
+    Parameters:
+    - values: Array-like with observed values and NaN where a projection is needed.
+    - expectations: Array-like of expected growth rates (%) aligned with `values`.
+    - lag (int): Distance in periods between a value and its base.
+
+    Returns:
+    - np.ndarray with observed values kept and missing values projected where possible.
+    """
+    values = np.asarray(values, dtype=float)
+    expectations = np.broadcast_to(np.asarray(expectations, dtype=float), values.shape)
+    *lead, n = values.shape
+    if n == 0:
+        return values.copy()
+
+    # Lay each series out as (periods // lag, lag) so every column is one chain of bases
+    rows = -(-n // lag)
+    pad = [(0, 0)] * len(lead) + [(0, rows * lag - n)]
+    v = np.pad(values, pad, constant_values=np.nan).reshape(*lead, rows, lag)
+    e = np.pad(expectations, pad, constant_values=np.nan).reshape(*lead, rows, lag)
+
+    observed = ~np.isnan(v)
+    factor = np.where(observed, v, 1 + e / 100)
+    broken = ~observed & np.isnan(factor)
+    factor = np.where(broken, 1.0, factor)
+
+    # Row of the last observed value at or before each position, within its chain
+    row_idx = np.arange(rows).reshape(rows, 1)
+    last_obs = np.maximum.accumulate(np.where(observed, row_idx, -1), axis=-2)
+    start = np.maximum(last_obs, 0)
+
+    def since_last_obs(term):
+        # Running sum of `term` from the last observed value (inclusive) up to each position
+        cum = np.cumsum(term, axis=-2)
+        return cum - np.take_along_axis(cum - term, start, axis=-2)
+
+    # Products are accumulated as sums of logs, tracking sign and zeros separately
+    magnitude = np.abs(factor)
+    zero = magnitude == 0
+    log_run = since_last_obs(np.log(np.where(zero, 1.0, magnitude)))
+    neg_run = since_last_obs((factor < 0).astype(int))
+    zero_run = since_last_obs(zero.astype(int))
+    broken_run = since_last_obs(broken.astype(int))
+
+    projected = np.exp(log_run) * np.where(neg_run % 2 == 1, -1.0, 1.0)
+    projected = np.where(zero_run > 0, 0.0, projected)
+    valid = (last_obs >= 0) & (broken_run == 0)
+    result = np.where(observed, v, np.where(valid, projected, np.nan))
+
+    return result.reshape(*lead, rows * lag)[..., :n]
+
+
+def project_gdp(path_data, df_observed=None, df_expected=None):
     """
     Projects quarterly GDP index based on year-over-year expectations from the Central Bank.
 
     Parameters:
     - path_data: Path to store and retrieve data files.
+    - df_observed, df_expected: Already extracted inputs; fetched when not given.
 
     Returns:
     - DataFrame with projected GDP index.
     """
-    df_observed = extract_data_sidra.get_ibge_gdp(path_data)
-    df_expected = extract_data_olinda.get_focus_gdp(path_data)
+    if df_observed is None:
+        df_observed = extract_data_sidra.get_ibge_gdp(path_data)
+    if df_expected is None:
+        df_expected = extract_data_olinda.get_focus_gdp(path_data)
 
     df_gdp = pd.merge(df_observed, df_expected, on='Quarter', how='outer').sort_values('Quarter')
     df_gdp = df_gdp.sort_index()
 
-    for i in range(len(df_gdp)):
-        if pd.isna(df_gdp.iloc[i]['gdp']) and i >= 4:
-            base = df_gdp.iloc[i - 4]['gdp']
-            expectation = df_gdp.iloc[i]['gdp_median_expectation']
-            if pd.notna(base) and pd.notna(expectation):
-                df_gdp.at[df_gdp.index[i], 'gdp'] = base * (1 + expectation / 100)
+    df_gdp['gdp'] = compound_projection(df_gdp['gdp'], df_gdp['gdp_median_expectation'], lag=4)
 
     df_gdp = df_gdp[['gdp']]
-    df_gdp.to_pickle(f'{path_data}/interim/gdp-quarterly.pkl')
+    storage.save_frame(df_gdp, f'{path_data}/interim/gdp-quarterly')
     return df_gdp
 
 
-def project_household_consumption(path_data):
+def project_household_consumption(path_data, df_observed=None, df_expected=None):
     """
     Projects quarterly household consumption index using yearly expectations from the Central Bank
     and interpolates intermediate quarters.
 
     Parameters:
     - path_data: Path to store and retrieve data files.
+    - df_observed, df_expected: Already extracted inputs; fetched when not given.
 
     Returns:
     - DataFrame with projected household consumption index.
     """
-    df_observed = extract_data_sidra.get_household_consumption(path_data)
-    df_expected = extract_data_olinda.get_focus_household_consumption(path_data)
+    if df_observed is None:
+        df_observed = extract_data_sidra.get_ibge_household_consumption(path_data)
+    if df_expected is None:
+        df_expected = extract_data_olinda.get_focus_household_consumption(path_data)
 
 
     idx_range = pd.date_range(start=df_observed.index[0], end=df_expected.index[-1], freq='QS') + pd.DateOffset(months=2)
@@ -58,33 +121,33 @@ def project_household_consumption(path_data):
 
     df_combined = df_combined.join(df_observed).join(df_expected).sort_index()
 
-    for i in range(len(df_combined)):
-        if pd.isna(df_combined.iloc[i]['household_consumption']) and i >= 4:
-            base = df_combined.iloc[i - 4]['household_consumption']
-            expectation = df_combined.iloc[i]['household_consumption_exp_median']
-            if pd.notna(base) and pd.notna(expectation):
-                df_combined.at[df_combined.index[i], 'household_consumption'] = base * (1 + expectation / 100)
+    df_combined['household_consumption'] = compound_projection(
+        df_combined['household_consumption'], df_combined['household_consumption_expectation'], lag=4
+    )
 
     df_combined['household_consumption'] = df_combined['household_consumption'].interpolate(method='cubic')
     df_combined = df_combined[['household_consumption']]
-    df_combined.to_pickle(f'{path_data}/interim/household_consumption-quarterly.pkl')
+    storage.save_frame(df_combined, f'{path_data}/interim/household_consumption-quarterly')
 
     return df_combined
 
 
-def project_industrial_gdp(path_data):
+def project_industrial_gdp(path_data, df_observed=None, df_expected=None):
     """
     Projects quarterly industrial GDP index using yearly expectations from the Central Bank
     and interpolates intermediate quarters.
 
     Parameters:
     - path_data: Path to store and retrieve data files.
+    - df_observed, df_expected: Already extracted inputs; fetched when not given.
 
     Returns:
     - DataFrame with projected industrial GDP index.
     """
-    df_observed = extract_data_sidra.get_ibge_industrial_gdp(path_data)
-    df_expected = extract_data_olinda.get_focus_industrial_gdp(path_data)
+    if df_observed is None:
+        df_observed = extract_data_sidra.get_ibge_industrial_gdp(path_data)
+    if df_expected is None:
+        df_expected = extract_data_olinda.get_focus_industrial_gdp(path_data)
 
 
     idx_range = pd.date_range(start=df_observed.index[0], end=df_expected.index[-1], freq='QS') + pd.DateOffset(months=2)
@@ -92,88 +155,102 @@ def project_industrial_gdp(path_data):
 
     df_combined = df_combined.join(df_observed).join(df_expected).sort_index()
 
-    for i in range(len(df_combined)):
-        if pd.isna(df_combined.iloc[i]['industrial_gdp']) and i >= 4:
-            base = df_combined.iloc[i - 4]['industrial_gdp']
-            expectation = df_combined.iloc[i]['industrial_gdp_exp_median']
-            if pd.notna(base) and pd.notna(expectation):
-                df_combined.at[df_combined.index[i], 'industrial_gdp'] = base * (1 + expectation / 100)
+    df_combined['industrial_gdp'] = compound_projection(
+        df_combined['industrial_gdp'], df_combined['industrial_gdp_expectation'], lag=4
+    )
 
     df_combined['industrial_gdp'] = df_combined['industrial_gdp'].interpolate(method='cubic')
     df_combined = df_combined[['industrial_gdp']]
-    df_combined.to_pickle(f'{path_data}/interim/industrial_gdp-quarterly.pkl')
+    storage.save_frame(df_combined, f'{path_data}/interim/industrial_gdp-quarterly')
 
     return df_combined
 
 
-def project_unemployment(path_data):
+def project_unemployment(path_data, df_observed=None, df_expected=None):
     """
     Combines observed and expected quarterly unemployment rates.
 
     Parameters:
     - path_data: Path to store and retrieve data files.
+    - df_observed, df_expected: Already extracted inputs; fetched when not given.
 
     Returns:
     - DataFrame with observed and expected unemployment rates.
     """
-    df_observed = extract_data_sidra.get_ibge_unemployment_rate(path_data)
-    df_expected = extract_data_olinda.get_focus_unemployment(path_data).rename(columns={'unemployment_exp_median': 'unemployment'})
+    if df_observed is None:
+        df_observed = extract_data_sidra.get_ibge_unemployment_rate(path_data)
+    if df_expected is None:
+        df_expected = extract_data_olinda.get_focus_unemployment(path_data)
+    df_expected = df_expected.rename(columns={'unemployment_expectation': 'unemployment_rate'})
 
 
     df_combined = pd.concat([df_observed, df_expected]).sort_values('Quarter')
-    df_combined.to_pickle(f'{path_data}/interim/unemployment-quarterly.pkl')
+    storage.save_frame(df_combined, f'{path_data}/interim/unemployment-quarterly')
 
     return df_combined
 
 
-def project_ipca(path_data):
+def project_ipca(path_data, df_observed=None, df_expected=None):
     """
     Projects monthly IPCA index based on year-over-year expectations,
     then selects quarter-end values (March, June, September, December).
 
     Parameters:
     - path_data: Path to store and retrieve data files.
+    - df_observed, df_expected: Already extracted inputs; fetched when not given.
 
     Returns:
     - DataFrame with quarterly projected IPCA index.
     """
-    df_observed = extract_data_sidra.get_ibge_ipca(path_data)
-    df_expected = extract_data_olinda.get_focus_ipca(path_data)
+    if df_observed is None:
+        df_observed = extract_data_sidra.get_ibge_ipca(path_data)
+    if df_expected is None:
+        df_expected = extract_data_olinda.get_focus_ipca(path_data)
 
 
     df_combined = pd.merge(df_observed, df_expected, on='Month', how='outer').sort_index()
 
-    for i in range(len(df_combined)):
-        if pd.isna(df_combined.iloc[i]['ipca']) and i >= 1:
-            base = df_combined.iloc[i - 1]['ipca']
-            expectation = df_combined.iloc[i]['ipca_exp_median']
-            if pd.notna(base) and pd.notna(expectation):
-                df_combined.at[df_combined.index[i], 'ipca'] = base * (1 + expectation / 100)
+    df_combined['ipca'] = compound_projection(df_combined['ipca'], df_combined['ipca_expectation'], lag=1)
 
     df_combined.reset_index(inplace=True)
     df_quarterly = df_combined[df_combined['Month'].dt.month.isin([3, 6, 9, 12])].copy()
     df_quarterly['Quarter'] = df_quarterly['Month'].dt.to_period('Q').dt.to_timestamp() + pd.DateOffset(months=2)
     df_quarterly.set_index('Quarter', inplace=True)
     df_quarterly = df_quarterly[['ipca']]
-    df_quarterly.to_pickle(f'{path_data}/interim/ipca-quarterly.pkl')
+    storage.save_frame(df_quarterly, f'{path_data}/interim/ipca-quarterly')
 
     return df_quarterly
 
 
-def project_selic(path_data):
+def project_selic(path_data, df_observed=None, df_expected=None):
     """
     Combines observed and expected quarterly Selic rate data.
 
     Parameters:
     - path_data: Path to store and retrieve data files.
+    - df_observed, df_expected: Already extracted inputs; fetched when not given.
 
     Returns:
     - DataFrame with projected Selic rates.
     """
-    df_observed = extract_data_bacen.get_selic_quarterly(path_data)
-    df_expected = extract_data_olinda.get_focus_selic(path_data).rename(columns={'median': 'selic_rate'})
+    if df_observed is None:
+        df_observed = extract_data_bacen.get_selic_quarterly(path_data)
+    if df_expected is None:
+        df_expected = extract_data_olinda.get_focus_selic(path_data)
+    df_expected = df_expected.rename(columns={'Mediana': 'selic_rate'})
 
     df_combined = pd.concat([df_observed, df_expected]).sort_index()
-    df_combined.to_pickle(f'{path_data}/interim/selic-quarterly.pkl')
+    storage.save_frame(df_combined, f'{path_data}/interim/selic-quarterly')
 
     return df_combined
+
+
+# Projection name -> (function, names of the extractions it consumes, in argument order)
+PROJECTIONS = {
+    'gdp': (project_gdp, ['ibge_gdp', 'focus_gdp']),
+    'household_consumption': (project_household_consumption, ['ibge_household_consumption', 'focus_household_consumption']),
+    'industrial_gdp': (project_industrial_gdp, ['ibge_industrial_gdp', 'focus_industrial_gdp']),
+    'unemployment': (project_unemployment, ['ibge_unemployment_rate', 'focus_unemployment']),
+    'ipca': (project_ipca, ['ibge_ipca', 'focus_ipca']),
+    'selic': (project_selic, ['selic_quarterly', 'focus_selic']),
+}
@@ -1,14 +1,34 @@
 # Import required libraries
 import warnings
+import os
 import pandas as pd
 import requests
 from io import StringIO
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pandas.errors import ParserError
+import http_session
+import response_cache
+import storage
+import schema
+import telemetry
 
 warnings.filterwarnings("ignore")
 
-def fetch_bcb_data(code, start: str, end: str, attempts=3, wait=2) -> pd.DataFrame:
+SGS_URL = "https://api.bcb.gov.br/dados/serie/"
+
+# Longest span SGS accepts in one request for daily series
+SGS_MAX_YEARS = 10
+
+# First date requested per SGS series (dd/mm/yyyy)
+SGS_START = {
+    20633: "01/01/2010",
+    20632: "01/01/2010",
+    22023: "01/01/2010",
+    432: "01/01/2014",
+}
+
+def fetch_bcb_data(code, start: str, end: str, attempts=3, wait=2, allow_empty=False) -> pd.DataFrame:
     """
     Downloads data from the Central Bank of Brazil API (SGS system).
     
@@ -18,89 +38,214 @@ def fetch_bcb_data(code, start: str, end: str, attempts=3, wait=2) -> pd.DataFra
     - end (str): End date in format 'dd/mm/yyyy'. Use '' for full series.
     - attempts (int): Number of retry attempts if request fails.
     - wait (int): Seconds to wait between attempts.
+    - allow_empty (bool): Return an empty DataFrame when SGS answers 404 (no observations in range).
 
     Returns:
     - pd.DataFrame with datetime index and values.
     """
     url = (
-        f"https://api.bcb.gov.br/dados/serie/bcdata.sgs.{code}/dados?formato=csv"
+        f"{SGS_URL}bcdata.sgs.{code}/dados?formato=csv"
         f"&dataInicial={start}&dataFinal={end}"
     )
     headers = {"Accept": "text/csv"}
 
     for attempt in range(1, attempts + 1):
         try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            df = pd.read_csv(StringIO(response.text), sep=';', decimal=',')
+            text = response_cache.cached_text(
+                'sgs', url, lambda: http_session.get_text(url, headers=headers)
+            )
+            df = pd.read_csv(StringIO(text), sep=';', decimal=',')
             df['data'] = pd.to_datetime(df['data'], dayfirst=True)
             return df.set_index('data')
         except (requests.RequestException, ParserError, ValueError) as e:
+            response = getattr(e, 'response', None)
+            if allow_empty and response is not None and response.status_code == 404:
+                return pd.DataFrame({'valor': pd.Series(dtype=float)}, index=pd.DatetimeIndex([], name='data'))
             print(f"Attempt {attempt} failed: {e}")
+            telemetry.event('sgs_attempt_failed', code=code, attempt=attempt, error=str(e))
             if attempt < attempts:
+                telemetry.count('retries')
                 time.sleep(wait)
             else:
                 raise RuntimeError(
                     f"Failed to fetch BCB data after {attempts} attempts."
                 ) from e
-def get_credit_concession_individuals(path_data):
+def plan_sgs_windows(start, end=None, max_years=SGS_MAX_YEARS):
+    """
+    Splits the span from `start` to `end` (today when not given) into consecutive windows
+    of at most `max_years` years, the longest range SGS serves in one request.
+
+    Parameters:
+    - start, end: Dates (Timestamps or 'dd/mm/yyyy' strings).
+    - max_years (int): Maximum length of a window.
+
+    Returns:
+    - list of (start, end) pairs of 'dd/mm/yyyy' strings, oldest first.
+    """
+    def to_date(value):
+        return pd.to_datetime(value, dayfirst=True).normalize()
+
+    start = to_date(start)
+    end = to_date(end) if end else pd.Timestamp.today().normalize()
+    windows = []
+    while start <= end:
+        stop = min(start + pd.DateOffset(years=max_years) - pd.Timedelta(days=1), end)
+        windows.append((start.strftime('%d/%m/%Y'), stop.strftime('%d/%m/%Y')))
+        start = stop + pd.Timedelta(days=1)
+    return windows
+def fetch_bcb_range(code, start, end=None, max_years=SGS_MAX_YEARS, max_workers=3) -> pd.DataFrame:
+    """
+    Downloads SGS series `code` between `start` and `end` (today when not given), split into
+    API-legal windows (plan_sgs_windows) that are fetched concurrently.
+
+    Returns:
+    - pd.DataFrame with datetime index and values, sorted by date, without repeated dates.
+    """
+    windows = plan_sgs_windows(start, end, max_years)
+    if not windows:
+        return pd.DataFrame({'valor': pd.Series(dtype=float)}, index=pd.DatetimeIndex([], name='data'))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parts = list(executor.map(
+            telemetry.propagate(lambda window: fetch_bcb_data(code, *window, allow_empty=True)), windows
+        ))
+    df = pd.concat(parts)
+    return df[~df.index.duplicated(keep='last')].sort_index()
+def period_end(series, freq='Q', how='last', complete_only=True) -> pd.Series:
+    """
+    Aggregates a daily series by calendar period, indexing each period by the first day of its
+    last month (yyyy-mm-01), as the rest of the pipeline does.
+
+    Parameters:
+    - series (pd.Series): Observations with a datetime index.
+    - freq (str): Period frequency, e.g. 'Q' or 'M'.
+    - how (str): 'last' (last observation within the period), 'mean' (average of the period's
+      observations) or 'end' (value in force on the period's last day, carried forward from
+      the latest observation, so periods without observations are filled too).
+    - complete_only (bool): Drop the final period when the series stops before its last business day.
+
+    Returns:
+    - pd.Series indexed by period.
+    """
+    if how not in ('last', 'mean', 'end'):
+        raise ValueError("how must be 'last', 'mean' or 'end'")
+    series = series.dropna().sort_index()
+    if series.empty:
+        return series.iloc[0:0]
+    periods = series.index.to_period(freq)
+
+    if how == 'last':
+        result = series[~periods.duplicated(keep='last')]
+        result.index = periods[~periods.duplicated(keep='last')]
+    elif how == 'mean':
+        result = series.groupby(periods).mean()
+    else:
+        span = pd.period_range(periods[0], periods[-1], freq=freq)
+        ends = span.to_timestamp(how='end').normalize()
+        result = pd.Series(series.reindex(ends, method='ffill').to_numpy(), index=span)
+
+    last_business_day = pd.offsets.BDay().rollback(result.index[-1].to_timestamp(how='end').normalize())
+    if complete_only and series.index[-1] < last_business_day:
+        result = result.iloc[:-1]
+
+    result.index = result.index.asfreq('M', how='end').to_timestamp()
+    return result
+def read_stored_series(path):
+    """
+    Reads a previously saved SGS series from `path`.
+    Returns None when the file does not exist, cannot be read or holds no observations.
+    """
+    try:
+        df = storage.load_frame(path)
+    except (OSError, ValueError, EOFError):
+        return None
+    return df if len(df) else None
+def update_bcb_series(code, stored, column='valor') -> pd.DataFrame:
+    """
+    Downloads only the observations of SGS series `code` dated after the newest date in `stored`
+    and merges them in, keeping the newest value when a date appears twice.
+
+    Parameters:
+    - code (int): The SGS code for the data series.
+    - stored (pd.DataFrame): Previously saved series with a datetime index.
+    - column (str): Name of the value column in `stored`.
+
+    Returns:
+    - pd.DataFrame with the stored and new observations, sorted by date.
+    """
+    start = stored.index.max() + pd.Timedelta(days=1)
+    new = fetch_bcb_range(code, start).rename(columns={'valor': column})
+    df = pd.concat([stored, new])
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    df.index.name = stored.index.name
+    return df
+def get_credit_concession_individuals(path_data, incremental=False):
     """
     Retrieves the volume of credit concessions to individuals from the BCB API
-    and saves the data as a Pickle file.
+    and saves the data to the raw layer.
+    With incremental=True, only observations after the last stored date are downloaded.
     """
-    df = fetch_bcb_data(20633, "01/01/2010", "")
-    df = df.rename(columns={'valor': 'credit_concession_individuals_million'})
-    df.to_pickle(f'{path_data}/raw/credit-concession-individuals.pkl')
+    path = f'{path_data}/raw/credit-concession-individuals'
+    stored = read_stored_series(path) if incremental else None
+    if stored is not None:
+        df = update_bcb_series(20633, stored, 'credit_concession_individuals_million')
+    else:
+        df = fetch_bcb_data(20633, SGS_START[20633], "")
+        df = df.rename(columns={'valor': 'credit_concession_individuals_million'})
+    df = schema.conform(df, os.path.basename(path))
+    storage.save_frame(df, path)
     return df
-def get_credit_concession_companies(path_data):
+def get_credit_concession_companies(path_data, incremental=False):
     """
     Retrieves the volume of credit concessions to companies from the BCB API
-    and saves the data as a Pickle file.
+    and saves the data to the raw layer.
+    With incremental=True, only observations after the last stored date are downloaded.
     """
-    df = fetch_bcb_data(20632, "01/01/2010", "")
-    df = df.rename(columns={'valor': 'credit_concession_companies_million'})
-    df.to_pickle(f'{path_data}/raw/credit-concession-companies.pkl')
+    path = f'{path_data}/raw/credit-concession-companies'
+    stored = read_stored_series(path) if incremental else None
+    if stored is not None:
+        df = update_bcb_series(20632, stored, 'credit_concession_companies_million')
+    else:
+        df = fetch_bcb_data(20632, SGS_START[20632], "")
+        df = df.rename(columns={'valor': 'credit_concession_companies_million'})
+    df = schema.conform(df, os.path.basename(path))
+    storage.save_frame(df, path)
     return df
-def get_avg_interest_rate_individuals(path_data):
+def get_avg_interest_rate_individuals(path_data, incremental=False):
     """
     Retrieves the average interest rate for credit operations with free resources – 
-    individuals (installment credit cards) from the BCB API and saves it as a Pickle file.
+    individuals (installment credit cards) from the BCB API and saves it to the raw layer.
+    With incremental=True, only observations after the last stored date are downloaded.
     """
-    df = fetch_bcb_data(22023, "01/01/2010", "")
-    df = df.rename(columns={'valor': 'avg_interest_rate_individuals'})
-    df.to_pickle(f'{path_data}/raw/avg-interest-rate-individuals.pkl')
+    path = f'{path_data}/raw/avg-interest-rate-individuals'
+    stored = read_stored_series(path) if incremental else None
+    if stored is not None:
+        df = update_bcb_series(22023, stored, 'avg_interest_rate_individuals')
+    else:
+        df = fetch_bcb_data(22023, SGS_START[22023], "")
+        df = df.rename(columns={'valor': 'avg_interest_rate_individuals'})
+    df = schema.conform(df, os.path.basename(path))
+    storage.save_frame(df, path)
     return df
-def get_selic_quarterly(path_data):
+def get_selic_quarterly(path_data, incremental=False):
     """
-    Retrieves the daily Selic target rate from the BCB API,
+    Retrieves the daily Selic target rate from the BCB API in 10-year windows fetched concurrently,
     selects the last available observation of each quarter,
-    and saves the result as a Pickle file.
-    """
-    # Download data in two blocks due to API limits
-    selic_2014_2021 = fetch_bcb_data(432, "01/01/2014", "31/12/2021")
-    selic_2022_onward = fetch_bcb_data(432, "01/01/2022", "")
-    df = pd.concat([selic_2014_2021, selic_2022_onward]).reset_index()
-
-    # Add helper columns
-    df['year'] = df['data'].dt.year
-    df['month'] = df['data'].dt.month
-
-    # Select last day of each quarter
-    df_quarters = df[df['month'].isin([3, 6, 9, 12])]
-    df_quarters = df_quarters[df_quarters['data'].dt.day.isin([30, 31])]
-    df_quarters = (
-        df_quarters
-        .sort_values('data')
-        .groupby(['year', 'month'])
-        .tail(1)
-    )
-    df_quarters['data'] = df_quarters['data'] + pd.offsets.MonthBegin(-1)
-    df_quarters = (
-        df_quarters
-        .drop(columns=['year', 'month'])
-        .rename(columns={'valor': 'selic_rate', 'data': 'Quarter'})
-        .set_index('Quarter')
-    )
+    and saves the result to the raw layer.
+    The daily series is kept in raw/selic-rate-daily; with incremental=True,
+    only the days after the last stored date are downloaded.
+    """
+    daily_path = f"{path_data}/raw/selic-rate-daily"
+    stored = read_stored_series(daily_path) if incremental else None
+    if stored is not None:
+        selic_daily = update_bcb_series(432, stored)
+    else:
+        selic_daily = fetch_bcb_range(432, SGS_START[432])
+    selic_daily = schema.conform(selic_daily, 'selic-rate-daily')
+    storage.save_frame(selic_daily, daily_path)
+
+    # Last observation of each calendar quarter; the quarter in progress is left out
+    df_quarters = period_end(selic_daily['valor'], 'Q', how='last').to_frame('selic_rate')
+    df_quarters = schema.conform(df_quarters, 'selic-rate-quarterly')
 
-    df_quarters.to_pickle(f"{path_data}/raw/selic-rate-quarterly.pkl")
+    storage.save_frame(df_quarters, f"{path_data}/raw/selic-rate-quarterly")
     return df_quarters
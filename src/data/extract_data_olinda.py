@@ -6,192 +6,437 @@
 
 # Import necessary libraries
 import warnings
+import os
 import pandas as pd
 import numpy as np
+from io import StringIO
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import http_session
+import response_cache
+import storage
+import schema
+import focus_vintages
+import periods
+import telemetry
 warnings.filterwarnings("ignore")
 
 #-----------------------
 
+def read_olinda_csv(url):
+    """
+    Downloads an Olinda OData query in CSV format through the local response cache and
+    the shared HTTP session (keep-alive, gzip and conditional revalidation),
+    and parses it with decimal commas.
+    """
+    text = response_cache.cached_text('olinda', url, lambda: http_session.get_text(url))
+    return pd.read_csv(StringIO(text), decimal=',')
+
+#-----------------------
+
 def quarter_to_date(x):
     """
     The reference date provided by Olinda is in the format t/yyyy,
-    so we need to manipulate the date to convert it into a timestamp format (yyyy-mm-01)
+    so we need to manipulate the date to convert it into a timestamp format (yyyy-mm-01).
+    Whole columns should be parsed with periods.olinda_quarter instead.
     """
-    end_month = {1: 3, 2: 6, 3: 9, 4: 12}
-    quarter, year = map(int, x.split('/'))
-    month = end_month[quarter]
-    return pd.Timestamp(year=year, month=month, day=1) + pd.offsets.MonthBegin(0)
+    return periods.olinda_quarter([x])[0]
 
 #-----------------------
 
-def get_focus_gdp(path_data):
+OLINDA_URL = "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
+
+# Indicators fetched together from ExpectativasMercadoTrimestrais:
+# key -> (Olinda indicator, number of latest rows kept, output column, raw file name)
+FOCUS_QUARTERLY = {
+    'gdp': ('PIB Total', 8, 'gdp_median_expectation', 'focus-gdp-quarterly'),
+    'unemployment': ('Taxa de desocupação', 6, 'unemployment_expectation', 'focus-unemployment-quarterly'),
+}
+
+# Indicators fetched together from ExpectativasMercadoAnuais (same layout as FOCUS_QUARTERLY)
+# Focus has no separate commerce indicator, so commerce GDP follows the services GDP expectation
+FOCUS_ANNUAL = {
+    'household_consumption': ('PIB Despesa de consumo das famílias', 5, 'household_consumption_expectation', 'focus-household-consumption-annual'),
+    'industrial_gdp': ('PIB Indústria', 5, 'industrial_gdp_expectation', 'focus-industrial-gdp-annual'),
+    'commerce_gdp': ('PIB Serviços', 5, 'commerce_gdp_expectation', 'focus-commerce-gdp-annual'),
+}
+
+# Monthly indicators of ExpectativaMercadoMensais (same layout as FOCUS_QUARTERLY)
+FOCUS_MONTHLY = {
+    'ipca': ('IPCA', 25, 'ipca_expectation', 'focus-ipca-monthly'),
+}
+
+# Statistics requested for every expectation: the median feeds the projections and the
+# dispersion across respondents feeds the scenarios (see scenarios.py)
+FOCUS_STATISTICS = 'Mediana,DesvioPadrao,Minimo,Maximo,numeroRespondentes'
+
+# Days of surveys requested by the batched quarterly and annual queries
+FOCUS_LOOKBACK_DAYS = 35
+
+# Characters left unencoded in OData parameter values
+SAFE_CHARS = "',/()"
+
+def olinda_url(endpoint, **params):
     """
-    Retrieves quarterly GDP expectations via the Olinda API from the Central Bank of Brazil,
-    processes the 'DataReferencia' into timestamp format (yyyy-mm-01), and saves it as a Pickle file.
-    """
-    # Data collection
-    url = (f"https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/" +
-           f"ExpectativasMercadoTrimestrais?$top=8&$filter=Indicador%20eq%20'PIB%20" +
-           f"Total'%20and%20baseCalculo%20eq%200&$orderby=Data%20desc&$format=text/" +
-           f"csv&$select=Data,DataReferencia,Mediana")
-    
-    gdp_expectations = pd.read_csv(url, decimal=',')
-    
-    # Initial processing
-    gdp_expectations['Quarter'] = gdp_expectations['DataReferencia'].apply(quarter_to_date)
-    gdp_expectations = (
-        gdp_expectations
-        .set_index('Quarter')
-        .drop(columns=['Data', 'DataReferencia'])
-        .rename(columns={'Mediana': 'gdp_median_expectation'})
+    Builds an Olinda OData URL for `endpoint`, percent-encoding the values of the `$` parameters
+    given as keyword arguments without the `$` (e.g. filter=..., orderby=...).
+    """
+    query = '&'.join(
+        f"${key}={quote(str(value), safe=SAFE_CHARS)}" for key, value in params.items()
     )
-    
-    # Export to pickle
-    gdp_expectations.to_pickle(f'{path_data}/raw/focus-gdp-quarterly.pkl')
-    return gdp_expectations
-def get_focus_household_consumption(path_data):
+    return f"{OLINDA_URL}{endpoint}?{query}"
+
+def fetch_focus_batch(endpoint, indicators, lookback_days=None, path_data=None):
     """
-    Retrieves annual expectations for Household Consumption from the Olinda API by the Central Bank of Brazil,
-    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result as a Pickle file.
+    Retrieves the latest expectations of several indicators of an Olinda endpoint with a single
+    OData query (indicators OR-chained in $filter, calculation base 0, survey dates within the
+    last `lookback_days` days).
+
+    Parameters:
+    - endpoint (str): Olinda resource, e.g. 'ExpectativasMercadoAnuais'.
+    - indicators (dict): Olinda indicator name -> number of latest rows to keep.
+    - lookback_days (int): Survey window requested; must cover the rows kept per indicator.
+      Defaults to FOCUS_LOOKBACK_DAYS.
+    - path_data: When given, every survey received is also added to the vintage store.
+
+    Returns:
+    - dict mapping each Olinda indicator name to its rows (newest survey first).
     """
-    url = (
-        "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
-        "ExpectativasMercadoAnuais?$top=5&$filter=Indicador%20eq%20'PIB%20"
-        "Despesa%20de%20consumo%20das%20fam%C3%ADlias'%20and%20baseCalculo%20eq%200&$orderby=Data%20desc&"
-        "$format=text/csv&$select=Indicador,Data,DataReferencia,Mediana"
+    names = ' or '.join(f"Indicador eq '{name}'" for name in indicators)
+    lookback_days = lookback_days or FOCUS_LOOKBACK_DAYS
+    since = (pd.Timestamp.today().normalize() - pd.Timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+    url = olinda_url(
+        endpoint,
+        filter=f"({names}) and baseCalculo eq 0 and Data ge '{since}'",
+        orderby='Data desc',
+        format='text/csv',
+        select=f'Indicador,Data,DataReferencia,{FOCUS_STATISTICS}',
     )
+    df = read_olinda_csv(url)
+    if path_data is not None:
+        focus_vintages.append_vintages(path_data, endpoint, df)
+    df = df.sort_values('Data', ascending=False, kind='stable')
+    groups = dict(tuple(df.groupby('Indicador', sort=False)))
+    return {
+        name: groups.get(name, df.iloc[0:0]).head(top).reset_index(drop=True)
+        for name, top in indicators.items()
+    }
 
-    df = pd.read_csv(url, decimal=',')
-    df['Year'] = pd.to_datetime(df['DataReferencia'], format='%Y')
-    df['Date'] = df['Year'].apply(lambda x: x.replace(month=12, day=1))
-    df = (
-        df.set_index('Date')
-          .drop(columns=['Year', 'DataReferencia', 'Indicador', 'Data'])
-          .rename(columns={'Mediana': 'household_consumption_expectation'})
-    )
+def quarterly_frame(rows, column):
+    """
+    Indexes Olinda quarterly rows by quarter (yyyy-mm-01, last month of the quarter)
+    and keeps the median renamed to `column`.
+    """
+    rows = rows.assign(Quarter=periods.olinda_quarter(rows['DataReferencia']))
+    return rows.set_index('Quarter')[['Mediana']].rename(columns={'Mediana': column})
 
-    df.to_pickle(f'{path_data}/raw/focus-household-consumption-annual.pkl')
-    return df
-def get_focus_industrial_gdp(path_data):
+def annual_frame(rows, column):
     """
-    Retrieves annual expectations for Industrial GDP from the Olinda API by the Central Bank of Brazil,
-    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result as a Pickle file.
+    Indexes Olinda annual rows by the December of the reference year (yyyy-12-01)
+    and keeps the median renamed to `column`.
     """
-    url = (
-        "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
-        "ExpectativasMercadoAnuais?$top=5&$filter=Indicador%20eq%20'PIB%20Ind%C3%BAstria'"
-        "&$orderby=Data%20desc&$format=text/csv&$select=Indicador,Data,DataReferencia,Mediana"
-    )
+    rows = rows.assign(Date=periods.olinda_year(rows['DataReferencia']))
+    return rows.set_index('Date')[['Mediana']].rename(columns={'Mediana': column})
 
-    df = pd.read_csv(url, decimal=',')
-    df['Year'] = pd.to_datetime(df['DataReferencia'], format='%Y')
-    df['Date'] = df['Year'].apply(lambda x: x.replace(month=12, day=1))
-    df = (
-        df.set_index('Date')
-          .drop(columns=['Year', 'DataReferencia', 'Indicador'])
-          .rename(columns={'Mediana': 'industrial_gdp_expectation'})
-    )
+def monthly_frame(rows, column):
+    """
+    Indexes Olinda monthly rows by month (yyyy-mm-01) and keeps the median renamed to `column`.
+    """
+    rows = rows.assign(Month=periods.olinda_month(rows['DataReferencia']))
+    return rows.set_index('Month')[['Mediana']].rename(columns={'Mediana': column})
 
-    df.to_pickle(f'{path_data}/raw/focus-industrial-gdp-annual.pkl')
-    return df
-def get_focus_commerce_gdp(path_data):
+def get_focus_quarterly(path_data, indicators=None):
     """
-    Retrieves annual expectations for Commerce GDP from the Olinda API by the Central Bank of Brazil,
-    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result as a Pickle file.
+    Retrieves quarterly expectations for several indicators (FOCUS_QUARTERLY) from the Olinda API
+    with a single request, converts 'DataReferencia' into timestamp format (yyyy-mm-01),
+    and saves each indicator to the raw layer.
+
+    Returns:
+    - dict mapping each key of FOCUS_QUARTERLY to its DataFrame.
     """
-    # Reusing the same endpoint as Industrial GDP
-    url = (
-        "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
-        "ExpectativasMercadoAnuais?$top=5&$filter=Indicador%20eq%20'PIB%20Ind%C3%BAstria'"
-        "&$orderby=Data%20desc&$format=text/csv&$select=Indicador,Data,DataReferencia,Mediana"
+    indicators = list(FOCUS_QUARTERLY) if indicators is None else list(indicators)
+    batch = fetch_focus_batch(
+        'ExpectativasMercadoTrimestrais',
+        {FOCUS_QUARTERLY[key][0]: FOCUS_QUARTERLY[key][1] for key in indicators},
+        path_data=path_data
     )
 
-    df = pd.read_csv(url, decimal=',')
-    df['Year'] = pd.to_datetime(df['DataReferencia'], format='%Y')
-    df['Date'] = df['Year'].apply(lambda x: x.replace(month=12, day=1))
-    df = (
-        df.set_index('Date')
-          .drop(columns=['Year', 'DataReferencia', 'Indicador'])
-          .rename(columns={'Mediana': 'commerce_gdp_expectation'})
+    frames = {}
+    for key in indicators:
+        name, _, column, filename = FOCUS_QUARTERLY[key]
+        df = schema.conform(quarterly_frame(batch[name], column), filename)
+        storage.save_frame(df, f'{path_data}/raw/{filename}')
+        frames[key] = df
+    return frames
+
+def get_focus_annual(path_data, indicators=None):
+    """
+    Retrieves annual expectations for several indicators (FOCUS_ANNUAL) from the Olinda API
+    with a single request, places each reference year in December (yyyy-12-01),
+    and saves each indicator to the raw layer.
+
+    Returns:
+    - dict mapping each key of FOCUS_ANNUAL to its DataFrame.
+    """
+    indicators = list(FOCUS_ANNUAL) if indicators is None else list(indicators)
+    batch = fetch_focus_batch(
+        'ExpectativasMercadoAnuais',
+        {FOCUS_ANNUAL[key][0]: FOCUS_ANNUAL[key][1] for key in indicators},
+        path_data=path_data
     )
 
-    df.to_pickle(f'{path_data}/raw/focus-commerce-gdp-annual.pkl')
-    return df
-def get_focus_unemployment(path_data):
+    frames = {}
+    for key in indicators:
+        name, _, column, filename = FOCUS_ANNUAL[key]
+        df = schema.conform(annual_frame(batch[name], column), filename)
+        storage.save_frame(df, f'{path_data}/raw/{filename}')
+        frames[key] = df
+    return frames
+
+def focus_source(key):
     """
-    Retrieves quarterly unemployment expectations from the Olinda API by the Central Bank of Brazil,
-    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result as a Pickle file.
+    Returns the Olinda endpoint and indicator name of a FOCUS_QUARTERLY, FOCUS_ANNUAL or FOCUS_MONTHLY key.
     """
-    def quarter_to_date(x):  # You can reuse the original helper if needed
-        end_month = {1: 3, 2: 6, 3: 9, 4: 12}
-        quarter, year = map(int, x.split('/'))
-        month = end_month[quarter]
-        return pd.Timestamp(year=year, month=month, day=1) + pd.offsets.MonthBegin(0)
+    if key in FOCUS_QUARTERLY:
+        return 'ExpectativasMercadoTrimestrais', FOCUS_QUARTERLY[key][0]
+    if key in FOCUS_MONTHLY:
+        return 'ExpectativaMercadoMensais', FOCUS_MONTHLY[key][0]
+    return 'ExpectativasMercadoAnuais', FOCUS_ANNUAL[key][0]
 
-    url = (
-        "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
-        "ExpectativasMercadoTrimestrais?$top=6&$filter=Indicador%20eq%20'Taxa%20de%20desocupa%C3%A7%C3%A3o'"
-        "%20and%20baseCalculo%20eq%200&$orderby=Data%20desc&$format=text/csv&$select=Data,DataReferencia,Mediana"
-    )
+def get_focus_as_of(path_data, key, as_of):
+    """
+    Rebuilds the expectations of a FOCUS_QUARTERLY, FOCUS_ANNUAL or FOCUS_MONTHLY indicator as they
+    were known on `as_of`, from the vintage store: for each reference period, the latest survey
+    published on or before that date. The result has the same layout as get_focus_quarterly,
+    get_focus_annual and get_focus_ipca, so it can be passed as df_expected to the build_features
+    projections. The store only holds the surveys seen by the extractions; seed_vintages adds the
+    full history.
+    """
+    endpoint, name = focus_source(key)
+    if key in FOCUS_QUARTERLY:
+        column, to_frame = FOCUS_QUARTERLY[key][2], quarterly_frame
+    elif key in FOCUS_MONTHLY:
+        column, to_frame = FOCUS_MONTHLY[key][2], monthly_frame
+    else:
+        column, to_frame = FOCUS_ANNUAL[key][2], annual_frame
+    rows = focus_vintages.expectations_as_of(path_data, endpoint, name, as_of)
+    return to_frame(rows.rename(columns={'reference': 'DataReferencia'}), column).sort_index()
 
-    df = pd.read_csv(url, decimal=',')
-    df['Quarter'] = df['DataReferencia'].apply(quarter_to_date)
-    df = (
-        df.set_index('Quarter')
-          .drop(columns=['Data', 'DataReferencia'])
-          .rename(columns={'Mediana': 'unemployment_expectation'})
-    )
+#-----------------------
 
-    df.to_pickle(f'{path_data}/raw/focus-unemployment-quarterly.pkl')
-    return df
+def get_focus_gdp(path_data):
+    """
+    Retrieves quarterly GDP expectations via the Olinda API from the Central Bank of Brazil,
+    processes the 'DataReferencia' into timestamp format (yyyy-mm-01), and saves it to the raw layer.
+    """
+    return get_focus_quarterly(path_data, ['gdp'])['gdp']
+def get_focus_household_consumption(path_data):
+    """
+    Retrieves annual expectations for Household Consumption from the Olinda API by the Central Bank of Brazil,
+    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result to the raw layer.
+    """
+    return get_focus_annual(path_data, ['household_consumption'])['household_consumption']
+def get_focus_industrial_gdp(path_data):
+    """
+    Retrieves annual expectations for Industrial GDP from the Olinda API by the Central Bank of Brazil,
+    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result to the raw layer.
+    """
+    return get_focus_annual(path_data, ['industrial_gdp'])['industrial_gdp']
+def get_focus_commerce_gdp(path_data):
+    """
+    Retrieves annual expectations for Commerce GDP from the Olinda API by the Central Bank of Brazil,
+    using the services GDP indicator (Focus has no separate commerce indicator),
+    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result to the raw layer.
+    """
+    return get_focus_annual(path_data, ['commerce_gdp'])['commerce_gdp']
+def get_focus_unemployment(path_data):
+    """
+    Retrieves quarterly unemployment expectations from the Olinda API by the Central Bank of Brazil,
+    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result to the raw layer.
+    """
+    return get_focus_quarterly(path_data, ['unemployment'])['unemployment']
 
 def get_focus_ipca(path_data):
     """
     Retrieves monthly IPCA expectations from the Olinda API by the Central Bank of Brazil,
-    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result as a Pickle file.
+    converts 'DataReferencia' into timestamp format (yyyy-mm-01), and saves the result to the raw layer.
     """
+    name, top, column, filename = FOCUS_MONTHLY['ipca']
     url = (
-        "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
-        "ExpectativaMercadoMensais?$top=25&$filter=Indicador%20eq%20'IPCA'%20and%20baseCalculo%20eq%200"
-        "&$orderby=Data%20desc&$format=text/csv&$select=Data,DataReferencia,Mediana"
+        f"{OLINDA_URL}ExpectativaMercadoMensais?$top={top}&$filter=Indicador%20eq%20'{name}'%20and%20baseCalculo%20eq%200"
+        f"&$orderby=Data%20desc&$format=text/csv&$select=Data,DataReferencia,{FOCUS_STATISTICS}"
     )
 
-    df = pd.read_csv(url, decimal=',')
-    df['Month'] = pd.to_datetime(df['DataReferencia'], format='%m/%Y')
-    df = (
-        df.set_index('Month')
-          .drop(columns=['Data', 'DataReferencia'])
-          .rename(columns={'Mediana': 'ipca_expectation'})
-          .sort_index()
-    )
+    df = read_olinda_csv(url)
+    focus_vintages.append_vintages(path_data, 'ExpectativaMercadoMensais', df.assign(Indicador=name))
+    df = schema.conform(monthly_frame(df, column).sort_index(), filename)
 
-    df.to_pickle(f'{path_data}/raw/focus-ipca-monthly.pkl')
+    storage.save_frame(df, f'{path_data}/raw/{filename}')
     return df
 
 def get_focus_selic(path_data):
     """
     Retrieves Selic expectations by meeting from the Olinda API by the Central Bank of Brazil,
     filters only even-numbered meetings to use them as quarterly observations,
-    converts them into timestamp format (yyyy-mm-01), and saves the result as a Pickle file.
+    converts them into timestamp format (yyyy-mm-01), and saves the result to the raw layer.
     """
     url = (
-        "https://olinda.bcb.gov.br/olinda/servico/Expectativas/versao/v1/odata/"
-        "ExpectativasMercadoSelic?$top=16&$filter=baseCalculo%20eq%200&$orderby=Data%20desc&"
-        "$format=text/csv&$select=Reuniao,Mediana"
+        f"{OLINDA_URL}ExpectativasMercadoSelic?$top=16&$filter=baseCalculo%20eq%200&$orderby=Data%20desc&"
+        f"$format=text/csv&$select=Indicador,Data,Reuniao,{FOCUS_STATISTICS}"
     )
 
-    df = pd.read_csv(url, decimal=',')
-    df[['Meeting', 'Year']] = df['Reuniao'].str.split('/', expand=True)
-    df = df[df['Meeting'].isin(['R2', 'R4', 'R6', 'R8'])]
-    
-    month_map = {'R2': 3, 'R4': 6, 'R6': 9, 'R8': 12}
-    df['Month'] = df['Meeting'].map(month_map)
-    df['Quarter'] = pd.to_datetime({
-        'year': df['Year'].astype(int),
-        'month': df['Month'],
-        'day': 1
-    })
-
-    df = df.set_index('Quarter').drop(columns=['Reuniao', 'Meeting', 'Year', 'Month'])
-    df.to_pickle(f'{path_data}/raw/focus-selic-quarterly.pkl')
+    df = read_olinda_csv(url)
+    focus_vintages.append_vintages(path_data, 'ExpectativasMercadoSelic', df)
+    # Even meetings (R2, R4, R6, R8) close the quarters; odd ones parse to NaT and are dropped
+    df['Quarter'] = periods.selic_meeting_quarter(df['Reuniao'])
+    df = df[df['Quarter'].notna()]
+
+    df = schema.conform(df.set_index('Quarter')[['Mediana']], 'focus-selic-quarterly')
+    storage.save_frame(df, f'{path_data}/raw/focus-selic-quarterly')
+    return df
+
+#-----------------------
+# Full expectation history, downloaded page by page
+
+# Columns requested for the history of each endpoint; the Selic endpoint is indexed by meeting
+HISTORY_REFERENCE = {'ExpectativasMercadoSelic': 'Reuniao'}
+# Columns that identify a row besides the survey date, reference period and indicator;
+# $skip paging needs $orderby to cover all of them, or rows that tie move between pages
+HISTORY_KEY_EXTRA = {'ExpectativasMercadoAnuais': ['IndicadorDetalhe']}
+HISTORY_STATISTICS = ['Media', 'Mediana', 'DesvioPadrao', 'Minimo', 'Maximo', 'numeroRespondentes', 'baseCalculo']
+
+def history_dir(path_data, endpoint, indicator=None):
+    """
+    Directory where the pages of an endpoint (and optionally a single indicator) are stored.
+    """
+    name = 'all' if indicator is None else quote(indicator, safe='')
+    return os.path.join(path_data, 'raw', 'focus-history', endpoint, name)
+
+def parse_history_page(text, reference):
+    """
+    Parses one CSV page of expectations into typed columns: categorical indicator and reference,
+    datetime survey date, float statistics and integer respondent count and calculation base.
+    """
+    df = pd.read_csv(StringIO(text), decimal=',', dtype={'Indicador': 'category', reference: 'category'})
+    df['Data'] = pd.to_datetime(df['Data'], format='%Y-%m-%d')
+    for column in ['Media', 'Mediana', 'DesvioPadrao', 'Minimo', 'Maximo']:
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    df['numeroRespondentes'] = pd.to_numeric(df['numeroRespondentes'], errors='coerce').astype('Int32')
+    df['baseCalculo'] = pd.to_numeric(df['baseCalculo'], errors='coerce').astype('Int8')
     return df
+
+def stream_focus_history(path_data, endpoint, indicator=None, page_size=10000, max_workers=4):
+    """
+    Downloads the full expectation history of an Olinda endpoint with $top/$skip paging.
+    Each page is parsed into a typed chunk and written straight to disk, so memory is bounded
+    by `max_workers` pages; pages are fetched concurrently.
+
+    Pages are ordered by survey date (then by the rest of the row key, so the order is total
+    and pages never overlap), so new surveys only ever append pages. An interrupted
+    download resumes from the missing pages, and a finished one is extended from its last
+    (partial) page on the next call.
+
+    Parameters:
+    - path_data: Path to store and retrieve data files.
+    - endpoint (str): Olinda resource, e.g. 'ExpectativasMercadoTrimestrais'.
+    - indicator (str): Olinda indicator to keep. Downloads every indicator when not given.
+    - page_size (int): Rows per request.
+    - max_workers (int): Pages fetched at the same time.
+
+    Returns:
+    - str with the directory holding the pages (part-000000, part-000001, ...).
+    """
+    reference = HISTORY_REFERENCE.get(endpoint, 'DataReferencia')
+    out_dir = history_dir(path_data, endpoint, indicator)
+    os.makedirs(out_dir, exist_ok=True)
+    params = {
+        'orderby': ','.join(['Data', 'Indicador', *HISTORY_KEY_EXTRA.get(endpoint, []), reference, 'baseCalculo']),
+        'format': 'text/csv',
+        'select': ','.join(['Indicador', 'Data', reference] + HISTORY_STATISTICS),
+    }
+    if indicator is not None:
+        params['filter'] = f"Indicador eq '{indicator}'"
+
+    def page_path(page):
+        return os.path.join(out_dir, f'part-{page:06d}')
+
+    def fetch_page(page):
+        url = olinda_url(endpoint, top=page_size, skip=page * page_size, **params)
+        # The page is kept on disk below, so its body is not also kept for revalidation
+        df = parse_history_page(http_session.get_text(url, revalidate=False), reference)
+        storage.save_frame(df, page_path(page))
+        return len(df)
+
+    # Pages already on disk are kept, except the last one if it was partial
+    stored = 0
+    while storage.find_frame(page_path(stored)):
+        stored += 1
+    page = stored
+    if stored and len(storage.load_frame(page_path(stored - 1), columns=['Data'])) < page_size:
+        page = stored - 1
+
+    # Fetch waves of pages until one comes back short; that page is the end of the history
+    last = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while last is None:
+            wave = list(range(page, page + max_workers))
+            sizes = list(executor.map(telemetry.propagate(fetch_page), wave))
+            short = [p for p, size in zip(wave, sizes) if size < page_size]
+            last = short[0] if short else None
+            page += max_workers
+
+    # Remove the empty pages fetched past the end
+    for extra in range(last + 1, page):
+        found = storage.find_frame(page_path(extra))
+        if found:
+            os.remove(found)
+    return out_dir
+
+def load_focus_history(path_data, endpoint, indicator=None, columns=None, start=None, end=None):
+    """
+    Reads the pages saved by stream_focus_history and concatenates them,
+    optionally keeping only some columns and survey dates between `start` and `end`.
+    """
+    out_dir = history_dir(path_data, endpoint, indicator)
+    if columns is not None and (start is not None or end is not None) and 'Data' not in columns:
+        columns = ['Data'] + list(columns)
+    parts = sorted({os.path.splitext(name)[0] for name in os.listdir(out_dir) if name.startswith('part-')})
+    chunks = []
+    for part in parts:
+        df = storage.load_frame(os.path.join(out_dir, part), columns=columns)
+        if start is not None:
+            df = df[df['Data'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['Data'] <= pd.Timestamp(end)]
+        chunks.append(df)
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+def seed_vintages(path_data, endpoint, indicator=None, download=True):
+    """
+    Adds the expectation history saved by stream_focus_history to the vintage store,
+    so as-of queries (get_focus_as_of) reach surveys older than the live extractions.
+    Only calculation base 0 is kept, as in the live extractions.
+
+    Parameters:
+    - path_data: Path to store and retrieve data files.
+    - endpoint (str): Olinda resource, e.g. 'ExpectativasMercadoTrimestrais'.
+    - indicator (str): Olinda indicator; the whole endpoint when not given.
+    - download (bool): Download (or extend) the history first; otherwise only the pages
+      already on disk are used.
+
+    Returns:
+    - int with the number of rows added to the store.
+    """
+    if download:
+        stream_focus_history(path_data, endpoint, indicator)
+    if not os.path.isdir(history_dir(path_data, endpoint, indicator)):
+        return 0
+    reference = HISTORY_REFERENCE.get(endpoint, 'DataReferencia')
+    statistics = [column for column in HISTORY_STATISTICS if column not in ('Media', 'baseCalculo')]
+    history = load_focus_history(
+        path_data, endpoint, indicator, columns=['Indicador', 'Data', reference, 'baseCalculo', *statistics]
+    )
+    if history.empty:
+        return 0
+    history = history[history['baseCalculo'] == 0].drop(columns='baseCalculo')
+    return focus_vintages.append_vintages(path_data, endpoint, history)
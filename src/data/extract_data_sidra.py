@@ -2,8 +2,19 @@
 # To learn more about the SIDRA API, visit: https://apisidra.ibge.gov.br/
 # Import necessary libraries
 import warnings
+import os
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import sidrapy
+import sidrapy.resources.handler as sidra_handler
+from sidrapy.resources.http_client import HttpClient
+import storage
+import schema
+import periods
+import response_cache
+import telemetry
 warnings.filterwarnings("ignore")
 
 # path_data = '../../data'
@@ -12,120 +23,149 @@ def quarter_to_timestamp(value):
     """
     Quarterly data comes with the reference date in the format yyyytt,
     so this function converts SIDRA dates to timestamp format (yyyy-mm-01).
+    Whole columns should be parsed with periods.sidra_quarter instead.
     """
-    year = int(str(value)[:4])
-    quarter = int(str(value)[-2:])
-    
-    # Map the quarter to its last corresponding month
-    last_month_of_quarter = {1: 3, 2: 6, 3: 9, 4: 12}
-    
-    month = last_month_of_quarter.get(quarter)
-    return pd.Timestamp(year=year, month=month, day=1)
+    return periods.sidra_quarter([value])[0]
 
 #-----------------------
 
-def get_ibge_gdp(path_data):
+# Session for the downloads made outside sidrapy.get_table. It comes from sidrapy, because
+# apisidra.ibge.gov.br only negotiates TLS with legacy renegotiation (OP_LEGACY_SERVER_CONNECT)
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_legacy_session():
     """
-    Retrieves quarterly total GDP index data from IBGE using the SIDRA API,
-    converts it to timestamp format (yyyy-mm-01), and exports it to a Pickle file.
+    Returns the process-wide SIDRA session, creating it on first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = HttpClient.get_legacy_session()
+    return _session
+
+
+def get_sidra_table(cache=True, **params):
+    """
+    Calls sidrapy.get_table with `params`, serving repeated requests from the local response cache,
+    and returns the result as a DataFrame of strings (as sidrapy does).
+
+    With cache=False the query is downloaded directly and not cached, for answers the caller
+    keeps elsewhere (e.g. the pieces of the regional tables, written to the raw layer).
+    """
+    if not cache:
+        response = get_legacy_session().get(sidra_handler.get_url(**params), timeout=60)
+        telemetry.count('requests')
+        telemetry.count('bytes', int(response.headers.get('Content-Length') or len(response.content)))
+        if not response.ok:
+            # Same error as sidrapy.get_table
+            raise ValueError(response.text)
+        return pd.DataFrame(response.json())
+
+    def fetch():
+        rows = sidrapy.get_table(**params, format='list')
+        telemetry.count('requests')
+        return rows
+
+    # sidrapy does not expose the response, so the size of the JSON cached for it is counted
+    data = response_cache.cached_json('sidra', params, fetch, count_bytes=True)
+    return pd.DataFrame(data)
+
+#-----------------------
+
+# Table 1621 (quarterly national accounts index, variable 584) indicators:
+# column name -> (category of classification 11255, raw file name)
+NATIONAL_ACCOUNTS = {
+    'gdp': ('90707', 'ibge-gdp-quarterly'),
+    'household_consumption': ('93404', 'ibge-household-consumption-quarterly'),
+    'industrial_gdp': ('90691', 'ibge-industrial-gdp-quarterly'),
+    'trade_gdp': ('90697', 'ibge-trade-gdp-quarterly'),
+}
+
+def get_ibge_national_accounts(path_data, indicators=None):
     """
-    gdp = sidrapy.get_table(
+    Retrieves several quarterly national accounts indexes from IBGE (table 1621) with a single
+    SIDRA request, splits the long-format result into one frame per indicator with a timestamp
+    index (yyyy-mm-01), and saves each of them to the raw layer under its usual name.
+
+    Parameters:
+    - path_data: Path to store and retrieve data files.
+    - indicators (list): Keys of NATIONAL_ACCOUNTS to retrieve. Retrieves all of them when not given.
+
+    Returns:
+    - dict mapping each indicator to its DataFrame.
+    """
+    indicators = list(NATIONAL_ACCOUNTS) if indicators is None else list(indicators)
+    categories = {NATIONAL_ACCOUNTS[indicator][0]: indicator for indicator in indicators}
+
+    data = get_sidra_table(
         table_code='1621',
         territorial_level="1",
         ibge_territorial_code="all",
         variable="584",
         period="all",
-        classifications={'11255': '90707'},
+        classifications={'11255': ','.join(categories)},
         header='n'
     )
-    gdp = gdp[['V', 'D2C']].rename(columns={'V': 'gdp', 'D2C': 'Quarter'})
-    gdp['gdp'] = pd.to_numeric(gdp['gdp'], errors='coerce')
-    gdp['Quarter'] = gdp['Quarter'].map(quarter_to_timestamp)
-    gdp.set_index('Quarter', inplace=True)
+    data = pd.DataFrame({
+        'value': pd.to_numeric(data['V'], errors='coerce'),
+        'Quarter': periods.sidra_quarter(data['D2C']),
+        'indicator': data['D4C'].map(categories),
+    })
 
-    gdp.to_pickle(f'{path_data}/raw/ibge-gdp-quarterly.pkl')
-    return gdp
+    frames = {}
+    for indicator, group in data.groupby('indicator', sort=False):
+        df = group.set_index('Quarter')[['value']].rename(columns={'value': indicator})
+        df = schema.conform(df, NATIONAL_ACCOUNTS[indicator][1])
+        storage.save_frame(df, f'{path_data}/raw/{NATIONAL_ACCOUNTS[indicator][1]}')
+        frames[indicator] = df
+    return frames
+
+#-----------------------
+
+def get_ibge_gdp(path_data):
+    """
+    Retrieves quarterly total GDP index data from IBGE using the SIDRA API,
+    converts it to timestamp format (yyyy-mm-01), and saves it to the raw layer.
+    """
+    return get_ibge_national_accounts(path_data, ['gdp'])['gdp']
 
 #-----------------------
 
 def get_ibge_household_consumption(path_data):
     """
     Retrieves quarterly household consumption index data from IBGE using the SIDRA API,
-    converts it to timestamp format (yyyy-mm-01), and exports it to a Pickle file.
+    converts it to timestamp format (yyyy-mm-01), and saves it to the raw layer.
     """
-    data = sidrapy.get_table(
-        table_code='1621',
-        territorial_level='1',
-        ibge_territorial_code='all',
-        variable='584',
-        period='all',
-        classifications={'11255': '93404'},
-        header='n'
-    )
-    data = data[['V', 'D2C']].rename(columns={'V': 'household_consumption', 'D2C': 'Quarter'})
-    data['household_consumption'] = pd.to_numeric(data['household_consumption'], errors='coerce')
-    data['Quarter'] = data['Quarter'].map(quarter_to_timestamp)
-    data.set_index('Quarter', inplace=True)
-
-    data.to_pickle(f'{path_data}/raw/ibge-household-consumption-quarterly.pkl')
-    return data
+    return get_ibge_national_accounts(path_data, ['household_consumption'])['household_consumption']
 
 #-----------------------
 
 def get_ibge_industrial_gdp(path_data):
     """
     Retrieves quarterly industrial GDP index data from IBGE using the SIDRA API,
-    converts it to timestamp format (yyyy-mm-01), and exports it to a Pickle file.
+    converts it to timestamp format (yyyy-mm-01), and saves it to the raw layer.
     """
-    data = sidrapy.get_table(
-        table_code='1621',
-        territorial_level="1",
-        ibge_territorial_code="all",
-        variable="584",
-        period="all",
-        classifications={'11255': '90691'},
-        header='n'
-    )
-    data = data[['V', 'D2C']].rename(columns={'V': 'industrial_gdp', 'D2C': 'Quarter'})
-    data['industrial_gdp'] = pd.to_numeric(data['industrial_gdp'], errors='coerce')
-    data['Quarter'] = data['Quarter'].map(quarter_to_timestamp)
-    data.set_index('Quarter', inplace=True)
-
-    data.to_pickle(f'{path_data}/raw/ibge-industrial-gdp-quarterly.pkl')
-    return data
+    return get_ibge_national_accounts(path_data, ['industrial_gdp'])['industrial_gdp']
 
 #-----------------------
 
 def get_ibge_trade_gdp(path_data):
     """
     Retrieves quarterly trade GDP index data from IBGE using the SIDRA API,
-    converts it to timestamp format (yyyy-mm-01), and exports it to a Pickle file.
+    converts it to timestamp format (yyyy-mm-01), and saves it to the raw layer.
     """
-    data = sidrapy.get_table(
-        table_code='1621',
-        territorial_level="1",
-        ibge_territorial_code="all",
-        variable="584",
-        period="all",
-        classifications={'11255': '90697'},
-        header='n'
-    )
-    data = data[['V', 'D2C']].rename(columns={'V': 'trade_gdp', 'D2C': 'Quarter'})
-    data['trade_gdp'] = pd.to_numeric(data['trade_gdp'], errors='coerce')
-    data['Quarter'] = data['Quarter'].map(quarter_to_timestamp)
-    data.set_index('Quarter', inplace=True)
-
-    data.to_pickle(f'{path_data}/raw/ibge-trade-gdp-quarterly.pkl')
-    return data
+    return get_ibge_national_accounts(path_data, ['trade_gdp'])['trade_gdp']
 
 #-----------------------
 
 def get_ibge_unemployment_rate(path_data):
     """
     Retrieves quarterly unemployment rate data from IBGE using the SIDRA API,
-    converts it to timestamp format (yyyy-mm-01), and exports it to a Pickle file.
+    converts it to timestamp format (yyyy-mm-01), and saves it to the raw layer.
     """
-    data = sidrapy.get_table(
+    data = get_sidra_table(
         table_code='4099',
         territorial_level='1',
         ibge_territorial_code='all',
@@ -135,10 +175,10 @@ def get_ibge_unemployment_rate(path_data):
     )
     data = data[['V', 'D2C']].rename(columns={'V': 'unemployment_rate', 'D2C': 'Quarter'})
     data['unemployment_rate'] = pd.to_numeric(data['unemployment_rate'], errors='coerce')
-    data['Quarter'] = data['Quarter'].map(quarter_to_timestamp)
-    data.set_index('Quarter', inplace=True)
+    data['Quarter'] = periods.sidra_quarter(data['Quarter'])
+    data = schema.conform(data.set_index('Quarter'), 'ibge-unemployment-rate-quarterly')
 
-    data.to_pickle(f'{path_data}/raw/ibge-unemployment-rate-quarterly.pkl')
+    storage.save_frame(data, f'{path_data}/raw/ibge-unemployment-rate-quarterly')
     return data
 
 #-----------------------
@@ -147,9 +187,9 @@ def get_ibge_ipca(path_data):
     """
     Retrieves monthly IPCA inflation index data from IBGE using the SIDRA API,
     removes the first row (Dec/1979), creates a datetime index in timestamp format (yyyy-mm-01),
-    and exports it to a Pickle file.
+    and saves it to the raw layer.
     """
-    data = sidrapy.get_table(
+    data = get_sidra_table(
         table_code='1737',
         territorial_level="1",
         ibge_territorial_code="all",
@@ -160,8 +200,9 @@ def get_ibge_ipca(path_data):
     data = data.drop([0])  # Remove Dec/1979 observation
     data = pd.DataFrame(data.loc[:, 'V'].astype(float)).rename(columns={'V': 'ipca'})
     data = data.assign(Month=pd.date_range('1980-01-01', periods=len(data), freq='MS')).set_index('Month')
+    data = schema.conform(data, 'ibge-ipca-monthly')
 
-    data.to_pickle(f'{path_data}/raw/ibge-ipca-monthly.pkl')
+    storage.save_frame(data, f'{path_data}/raw/ibge-ipca-monthly')
     return data
 
 #-----------------------
@@ -170,9 +211,9 @@ def get_ibge_pmc(path_data):
     """
     Retrieves monthly retail sales index (PMC) data from IBGE using the SIDRA API,
     creates a datetime index in timestamp format (yyyy-mm-01),
-    and exports it to a Pickle file.
+    and saves it to the raw layer.
     """
-    data = sidrapy.get_table(
+    data = get_sidra_table(
         table_code='8881',
         territorial_level="1",
         ibge_territorial_code="all",
@@ -183,6 +224,170 @@ def get_ibge_pmc(path_data):
     )
     data = pd.DataFrame(data.loc[:, 'V'].astype(float)).rename(columns={'V': 'pmc'})
     data = data.assign(Month=pd.date_range('2003-01-01', periods=len(data), freq='MS')).set_index('Month')
+    data = schema.conform(data, 'ibge-pmc-monthly')
 
-    data.to_pickle(f'{path_data}/raw/ibge-pmc-monthly.pkl')
+    storage.save_frame(data, f'{path_data}/raw/ibge-pmc-monthly')
     return data
+
+#-----------------------
+# Regional tables (UFs, metropolitan areas and municipalities), streamed to disk piece by piece
+
+# Territorial levels of the SIDRA API
+TERRITORIAL_LEVELS = {'uf': '3', 'municipality': '6', 'metro': '7'}
+
+# Regional indicator -> query parameters, frequency ('Q' or 'M'), first year available and the
+# territorial levels the table is published at (the first one is the default)
+REGIONAL_TABLES = {
+    # IPCA by metropolitan area and capital: monthly change (%) of the general index
+    'ipca': {'table_code': '7060', 'variable': '63', 'classifications': {'315': '7169'}, 'freq': 'M', 'first_year': 2020,
+             'levels': ('metro', 'municipality')},
+    # PMC by state: retail sales volume index
+    'pmc': {'table_code': '8881', 'variable': '7170', 'classifications': {'11046': '56736'}, 'freq': 'M', 'first_year': 2003,
+            'levels': ('uf',)},
+    # PNAD Contínua unemployment rate by state, metropolitan area and capital
+    'unemployment': {'table_code': '4099', 'variable': '4099', 'classifications': None, 'freq': 'Q', 'first_year': 2012,
+                     'levels': ('uf', 'metro', 'municipality')},
+}
+
+def regional_level(indicator, level=None):
+    """
+    Returns `level`, or the default level of the regional table when not given.
+
+    Raises:
+    - ValueError when the table is not published at `level`.
+    """
+    levels = REGIONAL_TABLES[indicator]['levels']
+    if level is None:
+        return levels[0]
+    if level not in levels:
+        raise ValueError(f"Regional table '{indicator}' is not available at level '{level}'. Options: {list(levels)}")
+    return level
+
+def regional_dir(path_data, indicator, level):
+    """
+    Directory where the pieces of a regional table are stored.
+    """
+    return os.path.join(path_data, 'raw', 'sidra-regional', indicator, level)
+
+def plan_regional_pieces(indicator, territories='all', start=None, end=None, territories_per_request=None):
+    """
+    Splits a regional extraction into requests of one year of periods and, optionally,
+    a bounded number of territories each.
+
+    Returns:
+    - list of (year, piece number, SIDRA period range, territorial codes) tuples.
+    """
+    spec = REGIONAL_TABLES[indicator]
+    start = int(start or spec['first_year'])
+    end = int(end or pd.Timestamp.today().year)
+    last = '12' if spec['freq'] == 'M' else '04'
+
+    if territories == 'all' or not territories_per_request:
+        groups = [territories if isinstance(territories, str) else ','.join(map(str, territories))]
+    else:
+        codes = list(map(str, territories))
+        groups = [','.join(codes[i:i + territories_per_request]) for i in range(0, len(codes), territories_per_request)]
+
+    return [
+        (year, piece, f'{year}01-{year}{last}', group)
+        for year in range(start, end + 1)
+        for piece, group in enumerate(groups)
+    ]
+
+def parse_regional_piece(rows, freq):
+    """
+    Parses the rows of one regional SIDRA answer (header='n') into a typed frame indexed by period
+    (yyyy-mm-01), with integer territory code, categorical territory name and float value.
+    Unavailable values ('-', '...', 'X') become NaN.
+    """
+    data = pd.DataFrame(rows, columns=['D1C', 'D1N', 'D2C', 'V'])
+    parse = periods.sidra_quarter if freq == 'Q' else periods.sidra_month
+    return pd.DataFrame({
+        'territory': pd.to_numeric(data['D1C'], errors='coerce').astype('Int64').array,
+        'territory_name': data['D1N'].astype('category').array,
+        'value': pd.to_numeric(data['V'], errors='coerce').array,
+    }, index=pd.DatetimeIndex(parse(data['D2C']), name='period'))
+
+def stream_regional_table(path_data, indicator, level=None, territories='all', start=None, end=None,
+                          territories_per_request=None, max_workers=4):
+    """
+    Downloads a regional SIDRA table piece by piece (one year of periods and a group of territories
+    per request), fetching pieces concurrently. Each piece is parsed into a typed chunk and written
+    straight to disk, so memory is bounded by `max_workers` pieces.
+
+    Pieces of past years already on disk are reused when they hold the same territories; the
+    current year is always fetched again. Pieces of the requested years that hold other territory
+    groups (from calls with other `territories` or `territories_per_request`) are removed, so the
+    directory never holds the same year twice.
+
+    Parameters:
+    - path_data: Path to store and retrieve data files.
+    - indicator (str): Key of REGIONAL_TABLES ('ipca', 'pmc' or 'unemployment').
+    - level (str): Key of TERRITORIAL_LEVELS ('uf', 'metro' or 'municipality') among the levels
+      of the table. Defaults to its first level.
+    - territories: 'all' or a list of territorial codes.
+    - start, end (int): First and last years. Default to the table's first year and the current year.
+    - territories_per_request (int): Split the territories into groups of this size.
+    - max_workers (int): Pieces fetched at the same time.
+
+    Returns:
+    - str with the directory holding the pieces (part-{year}-{hash of the period and territories}).
+    """
+    spec = REGIONAL_TABLES[indicator]
+    level = regional_level(indicator, level)
+    out_dir = regional_dir(path_data, indicator, level)
+    os.makedirs(out_dir, exist_ok=True)
+    current_year = pd.Timestamp.today().year
+
+    def piece_name(piece):
+        year, _, period, codes = piece
+        return f"part-{year}-{hashlib.sha256(f'{period}/{codes}'.encode('utf-8')).hexdigest()[:16]}"
+
+    def fetch_piece(piece):
+        year, _, period, codes = piece
+        path = os.path.join(out_dir, piece_name(piece))
+        if year < current_year and storage.find_frame(path):
+            return 0
+        rows = get_sidra_table(
+            table_code=spec['table_code'],
+            territorial_level=TERRITORIAL_LEVELS[level],
+            ibge_territorial_code=codes,
+            variable=spec['variable'],
+            period=period,
+            classifications=spec['classifications'],
+            header='n',
+            cache=False,  # the piece itself is kept on disk
+        )
+        df = parse_regional_piece(rows, spec['freq'])
+        storage.save_frame(df, path)
+        return len(df)
+
+    pieces = plan_regional_pieces(indicator, territories, start, end, territories_per_request)
+    planned = {piece_name(piece) for piece in pieces}
+    years = {f'part-{piece[0]}-' for piece in pieces}
+    for entry in os.listdir(out_dir):
+        name = os.path.splitext(entry)[0]
+        if name[:len('part-yyyy-')] in years and name not in planned:
+            os.remove(os.path.join(out_dir, entry))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(telemetry.propagate(fetch_piece), pieces))
+    return out_dir
+
+def load_regional_table(path_data, indicator, level=None, columns=None, territories=None, start=None, end=None):
+    """
+    Reads the pieces saved by stream_regional_table and concatenates them, optionally keeping only
+    some columns, territories and periods between `start` and `end`.
+    """
+    out_dir = regional_dir(path_data, indicator, regional_level(indicator, level))
+    needed = None
+    if columns is not None:
+        needed = list(dict.fromkeys(list(columns) + (['territory'] if territories is not None else [])))
+    parts = sorted({os.path.splitext(name)[0] for name in os.listdir(out_dir) if name.startswith('part-')})
+    chunks = []
+    for part in parts:
+        df = storage.load_frame(os.path.join(out_dir, part), columns=needed, start=start, end=end)
+        if territories is not None:
+            df = df[df['territory'].isin([int(code) for code in territories])]
+        chunks.append(df)
+    return pd.concat(chunks) if chunks else pd.DataFrame()
@@ -0,0 +1,170 @@
+# Append-only store of Focus expectation vintages
+# Every survey (Data) of every indicator and reference period is kept, so projections can be
+# rebuilt with the expectations that were known at any past date ("as of" queries)
+# Import libraries
+import warnings
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import storage
+
+warnings.filterwarnings("ignore")
+
+KEY = ['Indicador', 'reference', 'Data']
+
+_loaded = {}
+_lock = threading.Lock()
+_append_lock = threading.Lock()
+
+
+def store_path(path_data, endpoint):
+    """
+    Location of the vintage store of an Olinda endpoint: a directory of parts, each holding the
+    rows added by one append (part-{nanoseconds}). Stores written as a single file by earlier
+    versions ({store_path}.arrow) are read as their first part.
+    """
+    return os.path.join(path_data, 'raw', 'focus-vintages', endpoint)
+
+
+# Appends write one small part each; once a store has this many parts they are merged into one
+COMPACT_PARTS = 32
+
+
+def _normalize(df):
+    # The Selic endpoint identifies the reference period by meeting instead of DataReferencia
+    df = df.rename(columns={'DataReferencia': 'reference', 'Reuniao': 'reference'})
+    df = df.astype({'Indicador': str, 'reference': str})
+    df['Data'] = pd.to_datetime(df['Data'])
+    return df
+
+
+def _parts(path):
+    """
+    Files of a store, oldest first.
+    """
+    parts = [storage.find_frame(path)] if storage.find_frame(path) else []
+    if os.path.isdir(path):
+        names = sorted({os.path.splitext(name)[0] for name in os.listdir(path) if name.startswith('part-')})
+        parts += [storage.find_frame(os.path.join(path, name)) for name in names]
+    return [part for part in parts if part]
+
+
+def _merge(frames):
+    df = pd.concat(frames, ignore_index=True)
+    # Parts are sorted runs, so the stable sort is close to a merge; the oldest copy of a key wins
+    df = df.sort_values(KEY, kind='stable', ignore_index=True)
+    return df.drop_duplicates(KEY, ignore_index=True)
+
+
+def load_vintages(path_data, endpoint):
+    """
+    Returns the whole vintage store of `endpoint`, sorted by indicator, reference period and
+    survey date. The frame is kept in memory; when parts were added since, only those are read
+    and merged into it.
+    """
+    path = store_path(path_data, endpoint)
+    for _ in range(3):
+        try:
+            parts = [(part, os.stat(part).st_mtime_ns) for part in _parts(path)]
+            if not parts:
+                return pd.DataFrame(columns=KEY + ['Mediana'])
+            with _lock:
+                cached = _loaded.get(path)
+            if cached and cached[0] == parts:
+                return cached[1]
+            if cached and parts[:len(cached[0])] == cached[0]:
+                added = [storage.load_frame(part) for part, _ in parts[len(cached[0]):]]
+                df = _merge([cached[1]] + added)
+            else:
+                df = _merge([storage.load_frame(part) for part, _ in parts])
+            break
+        except FileNotFoundError:  # parts removed by a compaction in the meantime
+            continue
+    else:
+        raise FileNotFoundError(f"The vintage store '{path}' kept changing while it was read.")
+    with _lock:
+        _loaded[path] = (parts, df)
+    return df
+
+
+def _compact(path, stored):
+    """
+    Replaces the parts of a store by a single part holding `stored`.
+    """
+    old = _parts(path)
+    storage.save_frame(stored, os.path.join(path, f'part-{time.time_ns():020d}'))
+    for part in old:
+        os.remove(part)
+
+
+def append_vintages(path_data, endpoint, df):
+    """
+    Adds the surveys in `df` (Olinda rows with Indicador, Data, DataReferencia or Reuniao and
+    statistics such as Mediana) to the store of `endpoint`. Rows already stored are never
+    changed or removed; only new (indicator, reference, survey date) keys are added.
+
+    Only the new rows are written, as a new part of the store, so an append costs
+    the size of the surveys added rather than the size of the history.
+
+    Returns:
+    - int with the number of rows added.
+    """
+    new = _normalize(df).drop_duplicates(KEY)
+    path = store_path(path_data, endpoint)
+    with _append_lock:
+        stored = load_vintages(path_data, endpoint)
+        if len(stored) and len(new):
+            # A known key has the same survey date, so only the stored rows of those dates are compared
+            candidates = stored[np.isin(stored['Data'].to_numpy(), new['Data'].unique())]
+            known = pd.MultiIndex.from_frame(candidates[KEY])
+            new = new[~pd.MultiIndex.from_frame(new[KEY]).isin(known)]
+        if new.empty:
+            return 0
+
+        os.makedirs(path, exist_ok=True)
+        new = new.sort_values(KEY, kind='stable', ignore_index=True)
+        storage.save_frame(new, os.path.join(path, f'part-{time.time_ns():020d}'))
+        if len(_parts(path)) > COMPACT_PARTS:
+            _compact(path, load_vintages(path_data, endpoint))
+    return len(new)
+
+
+def store_version(path_data, endpoint):
+    """
+    Version of the store of `endpoint`: its number of rows. Rows are only ever added,
+    so it changes exactly when new surveys are stored (and not when parts are compacted).
+    """
+    return len(load_vintages(path_data, endpoint))
+
+
+def expectations_as_of(path_data, endpoint, indicator, as_of, columns=('Mediana',)):
+    """
+    Returns, for every reference period of `indicator`, the latest survey published
+    on or before `as_of`.
+
+    The store is sorted by (indicator, reference, survey date), so the indicator is located with
+    a binary search and the last row of each reference period is found without grouping.
+
+    Parameters:
+    - path_data: Path to store and retrieve data files.
+    - endpoint (str): Olinda resource, e.g. 'ExpectativasMercadoTrimestrais'.
+    - indicator (str): Olinda indicator name, e.g. 'PIB Total'.
+    - as_of: Date of the query.
+    - columns (tuple): Statistics to return.
+
+    Returns:
+    - pd.DataFrame with 'reference', 'Data' and `columns`, one row per reference period.
+    """
+    df = load_vintages(path_data, endpoint)
+    indicators = df['Indicador'].to_numpy(dtype=object)
+    lo = np.searchsorted(indicators, indicator, side='left')
+    hi = np.searchsorted(indicators, indicator, side='right')
+    rows = df.iloc[lo:hi]
+
+    rows = rows[rows['Data'].to_numpy() <= np.datetime64(pd.Timestamp(as_of))]
+    reference = rows['reference'].to_numpy(dtype=object)
+    last_of_reference = np.ones(len(rows), dtype=bool)
+    last_of_reference[:-1] = reference[1:] != reference[:-1]
+    return rows[last_of_reference][['reference', 'Data', *columns]].reset_index(drop=True)
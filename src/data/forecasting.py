@@ -0,0 +1,242 @@
+# Statistical forecasting helpers used by make_dataset
+# Import libraries
+import warnings
+import os
+import json
+import time
+import pickle
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import pmdarima as pm
+
+warnings.filterwarnings("ignore")
+
+
+def _fit_candidate(values, order, criterion, test_size):
+    """
+    Fits one ARIMA candidate and scores it. Runs in a worker process.
+    """
+    warnings.filterwarnings("ignore")
+    started = time.perf_counter()
+    result = {'p': order[0], 'd': order[1], 'q': order[2], 'aic': np.nan, 'oos_rmse': np.nan, 'error': None}
+    try:
+        if criterion == 'oos':
+            train, test = values[:-test_size], values[-test_size:]
+            model = pm.ARIMA(order=order).fit(train)
+            forecast = np.asarray(model.predict(n_periods=test_size))
+            result['oos_rmse'] = float(np.sqrt(np.mean((forecast - test) ** 2)))
+            result['aic'] = float(model.aic())
+        else:
+            result['aic'] = float(pm.ARIMA(order=order).fit(values).aic())
+    except Exception as e:  # a candidate that does not converge is ranked last
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def search_arima_order(series, p_values=range(0, 4), d_values=None, q_values=range(0, 4),
+                       criterion='aic', test_size=8, max_workers=None):
+    """
+    Fits a grid of ARIMA (p, d, q) candidates across a process pool and ranks them.
+
+    Parameters:
+    - series (pd.Series): Series to model, without missing values.
+    - p_values, d_values, q_values: Candidate AR, differencing and MA orders. By default the
+      differencing order is fixed first by unit-root tests (pm.arima.ndiffs, KPSS, up to 2).
+    - criterion (str): 'aic' (in-sample Akaike criterion) or 'oos' (RMSE of a forecast
+      of the last `test_size` observations from a model fitted on the rest). The AIC of models
+      with different differencing orders is fitted to different series and is not comparable,
+      so 'aic' takes a single differencing order; 'oos' can rank several.
+    - test_size (int): Hold-out length for criterion='oos'.
+    - max_workers (int): Worker processes. Defaults to the number of CPUs.
+
+    Returns:
+    - (model, table): the best candidate refitted on the whole series, and a DataFrame with
+      one row per candidate (p, d, q, aic, oos_rmse, score, seconds, error) sorted by score.
+      table.attrs['wall_seconds'] holds the duration of the whole search.
+    """
+    if criterion not in ('aic', 'oos'):
+        raise ValueError("criterion must be 'aic' or 'oos'")
+    values = np.asarray(series, dtype=float)
+    if d_values is None:
+        d_values = [pm.arima.ndiffs(values, test='kpss', max_d=2)]
+    d_values = list(d_values)
+    if criterion == 'aic' and len(d_values) > 1:
+        raise ValueError("AIC is not comparable across differencing orders: give a single d or use criterion='oos'")
+    orders = list(itertools.product(p_values, d_values, q_values))
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            _fit_candidate,
+            itertools.repeat(values), orders, itertools.repeat(criterion), itertools.repeat(test_size)
+        ))
+
+    table = pd.DataFrame(results)
+    table['score'] = table['oos_rmse'] if criterion == 'oos' else table['aic']
+    table = table.sort_values('score', na_position='last', ignore_index=True)
+    table = table[['p', 'd', 'q', 'aic', 'oos_rmse', 'score', 'seconds', 'error']]
+    table.attrs['wall_seconds'] = time.perf_counter() - started
+
+    if table['score'].isna().all():
+        raise RuntimeError("No ARIMA candidate could be fitted.")
+    best = tuple(int(table.loc[0, term]) for term in ('p', 'd', 'q'))
+    model = pm.ARIMA(order=best).fit(values)
+    return model, table
+
+
+#-----------------------
+# Fitted-model cache
+
+def series_hash(values):
+    """
+    Returns a hash of the values of a series (as float64).
+    """
+    return hashlib.sha256(np.ascontiguousarray(values, dtype=float).tobytes()).hexdigest()
+
+
+def _model_paths(cache_dir, order):
+    name = 'arima-' + '-'.join(str(term) for term in order)
+    return os.path.join(cache_dir, f'{name}.pkl'), os.path.join(cache_dir, f'{name}.json')
+
+
+def _write_atomic(path, data):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def store_fitted(model, values, order, cache_dir):
+    """
+    Saves a fitted ARIMA together with the length and hash of the series it was trained on.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    model_path, meta_path = _model_paths(cache_dir, order)
+    values = np.asarray(values, dtype=float)
+    meta = {'order': [int(term) for term in order], 'n': len(values), 'hash': series_hash(values)}
+    _write_atomic(model_path, pickle.dumps(model))
+    _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+
+def fit_arima_cached(series, order, cache_dir):
+    """
+    Returns an ARIMA of the given order fitted to `series`, reusing the model saved for that order
+    under `cache_dir` when possible:
+    - same training data: the saved model is returned as is;
+    - the series only extends the training data: the saved model is updated with the new points;
+    - otherwise (history revised, or no saved model): the model is refitted from scratch.
+
+    Returns:
+    - (model, status) with status 'reused', 'updated' or 'refit'.
+    """
+    values = np.asarray(series, dtype=float)
+    order = tuple(order)
+    model_path, meta_path = _model_paths(cache_dir, order)
+
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(model_path, 'rb') as f:
+            model = pickle.load(f)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError):
+        meta, model = None, None
+
+    if meta and meta['n'] <= len(values) and series_hash(values[:meta['n']]) == meta['hash']:
+        if meta['n'] == len(values):
+            return model, 'reused'
+        model.update(values[meta['n']:])
+        status = 'updated'
+    else:
+        model = pm.ARIMA(order=order).fit(values)
+        status = 'refit'
+
+    store_fitted(model, values, order, cache_dir)
+    return model, status
+
+
+#-----------------------
+# Batch forecasting
+
+def _forecast_series(name, values, steps, order):
+    """
+    Fits one model to a series and forecasts `steps` periods. Runs in a worker process.
+    The order is chosen by pmdarima.auto_arima when not given.
+    """
+    warnings.filterwarnings("ignore")
+    started = time.perf_counter()
+    result = {'series': name, 'order': None, 'n_obs': len(values), 'steps': steps, 'forecast': None, 'error': None}
+    try:
+        if order is None:
+            model = pm.auto_arima(values, seasonal=False, error_action='ignore', suppress_warnings=True)
+        else:
+            model = pm.ARIMA(order=tuple(order)).fit(values)
+        result['order'] = str(tuple(int(term) for term in model.order))
+        if steps:
+            result['forecast'] = np.asarray(model.predict(n_periods=steps), dtype=float)
+    except Exception as e:  # a series that cannot be modelled keeps its gap instead of aborting the batch
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def forecast_batch(df, periods=8, freq='3MS', orders=None, min_obs=8, max_workers=None):
+    """
+    Extends every column of a wide frame to a common horizon, fitting one model per column
+    across a process pool.
+
+    The horizon is `periods` steps of `freq` after the last row of `df`. Each column is
+    forecast from its last valid value up to the horizon; values already present
+    (observed or projected from expectations) are kept. Repeated dates are collapsed to the
+    first non-missing value of each column.
+
+    Parameters:
+    - df (pd.DataFrame): One column per series on a regular DatetimeIndex.
+    - periods (int): Steps added after the last row of `df`.
+    - freq (str): Frequency of the index.
+    - orders (dict): Optional (p, d, q) per column. Columns without an order use auto_arima.
+    - min_obs (int): Columns with fewer valid values are not modelled.
+    - max_workers (int): Worker processes. Defaults to the number of CPUs.
+
+    Returns:
+    - (frame, table): the extended wide frame, and a DataFrame with one row per column
+      (series, order, n_obs, steps, seconds, error). table.attrs['wall_seconds'] holds
+      the duration of the whole batch.
+    """
+    orders = orders or {}
+    if df.index.has_duplicates:
+        df = df.groupby(level=0, sort=False).first()
+    extension = pd.date_range(df.index[-1], periods=periods + 1, freq=freq, name=df.index.name)[1:]
+    index = df.index.append(extension)
+    frame = df.reindex(index)
+
+    names, series_values, steps, series_orders = [], [], [], []
+    skipped = []
+    for name in frame.columns:
+        column = frame[name]
+        last_valid = column.last_valid_index()
+        values = column.loc[:last_valid].dropna().to_numpy(dtype=float) if last_valid is not None else np.array([])
+        if len(values) < min_obs:
+            skipped.append({'series': name, 'order': None, 'n_obs': len(values), 'steps': 0,
+                            'seconds': 0.0, 'error': f'fewer than {min_obs} observations'})
+            continue
+        names.append(name)
+        series_values.append(values)
+        steps.append(len(index) - index.get_loc(last_valid) - 1)
+        series_orders.append(orders.get(name))
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_forecast_series, names, series_values, steps, series_orders))
+
+    for result in results:
+        if result['forecast'] is not None:
+            frame.iloc[len(index) - result['steps']:, frame.columns.get_loc(result['series'])] = result['forecast']
+
+    table = pd.DataFrame([{k: v for k, v in r.items() if k != 'forecast'} for r in results] + skipped,
+                         columns=['series', 'order', 'n_obs', 'steps', 'seconds', 'error'])
+    table.attrs['wall_seconds'] = time.perf_counter() - started
+    return frame, table
@@ -0,0 +1,166 @@
+# Shared HTTP layer for the Central Bank extractors (SGS and Olinda)
+# Keeps TCP/TLS connections alive across calls, negotiates gzip and revalidates
+# previously downloaded responses with ETag / If-Modified-Since
+# Import libraries
+import warnings
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import requests
+from requests.adapters import HTTPAdapter
+import telemetry
+
+warnings.filterwarnings("ignore")
+
+# Directory where response bodies and their validators are kept between runs.
+# When None, validators are only remembered for the lifetime of the process.
+CACHE_DIR = None
+
+_session = None
+_session_lock = threading.Lock()
+# Validators of recent responses, least recently used first. Bodies are read from CACHE_DIR
+# when needed and only kept here when there is no cache directory
+_memory = OrderedDict()
+_memory_lock = threading.Lock()
+MEMORY_ENTRIES = 256
+
+
+def set_cache_dir(path):
+    """
+    Sets the directory used to keep response bodies and validators between runs.
+    """
+    global CACHE_DIR
+    CACHE_DIR = path
+    if path:
+        os.makedirs(path, exist_ok=True)
+
+
+def get_session():
+    """
+    Returns the process-wide requests.Session, creating it on first use.
+    The session keeps a pool of keep-alive connections per host and asks for gzip responses.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _session = session
+    return _session
+
+
+def _cache_paths(url):
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return os.path.join(CACHE_DIR, f'{key}.json'), os.path.join(CACHE_DIR, f'{key}.body')
+
+
+def _remember(url, entry):
+    with _memory_lock:
+        _memory[url] = entry
+        _memory.move_to_end(url)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def _load_cached(url):
+    """
+    Returns the validators of the last response to `url` (etag, last_modified and, without
+    a cache directory, body), or None.
+    """
+    with _memory_lock:
+        if url in _memory:
+            _memory.move_to_end(url)
+            return _memory[url]
+    if not CACHE_DIR:
+        return None
+    meta_path, _ = _cache_paths(url)
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _remember(url, meta)
+    return meta
+
+
+def _cached_body(url, cached):
+    if 'body' in cached:
+        return cached['body']
+    try:
+        with open(_cache_paths(url)[1], encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _store_cached(url, etag, last_modified, body):
+    entry = {'url': url, 'etag': etag, 'last_modified': last_modified}
+    if not CACHE_DIR:
+        _remember(url, {**entry, 'body': body})
+        return
+    meta_path, body_path = _cache_paths(url)
+    suffix = f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    # Body first, then metadata, each replaced atomically so readers never see a partial entry
+    with open(body_path + suffix, 'w', encoding='utf-8') as f:
+        f.write(body)
+    os.replace(body_path + suffix, body_path)
+    with open(meta_path + suffix, 'w', encoding='utf-8') as f:
+        json.dump(entry, f)
+    os.replace(meta_path + suffix, meta_path)
+    _remember(url, entry)
+
+
+def get_text(url, headers=None, timeout=60, revalidate=True):
+    """
+    Downloads `url` through the shared session and returns the response body as text.
+
+    If a previous response carried an ETag or Last-Modified header, the request is sent
+    as a conditional GET; a 304 Not Modified answer is served from the local copy.
+
+    Parameters:
+    - url (str): Address to download.
+    - headers (dict): Extra request headers.
+    - timeout (int): Seconds to wait for the server.
+    - revalidate (bool): Keep the validators and body of the response for conditional requests.
+      Callers that store the body themselves (e.g. the Focus history pages) pass False,
+      so it is not written twice.
+
+    Returns:
+    - str with the response body.
+
+    Raises:
+    - requests.RequestException for connection errors and non-2xx/304 responses.
+    """
+    request_headers = dict(headers or {})
+    cached = _load_cached(url) if revalidate else None
+    if cached:
+        if cached.get('etag'):
+            request_headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            request_headers['If-Modified-Since'] = cached['last_modified']
+
+    response = get_session().get(url, headers=request_headers, timeout=timeout)
+    # Bytes on the wire (compressed) when the server sends Content-Length
+    telemetry.count('requests')
+    telemetry.count('bytes', int(response.headers.get('Content-Length') or len(response.content)))
+    body = _cached_body(url, cached) if response.status_code == 304 and cached else None
+    if body is not None:
+        telemetry.count('not_modified')
+        return body
+    if response.status_code == 304:
+        # The local copy of the body disappeared: download the full response again
+        response = get_session().get(url, headers=headers, timeout=timeout)
+        telemetry.count('requests')
+        telemetry.count('bytes', int(response.headers.get('Content-Length') or len(response.content)))
+    response.raise_for_status()
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if revalidate and (etag or last_modified):
+        _store_cached(url, etag, last_modified, response.text)
+    return response.text
@@ -1,14 +1,23 @@
 import pandas as pd
 import numpy as np
 import os
-import pmdarima as pm
+from functools import partial
 
 import build_features
-import coleta_dados_sidra
+import http_session
+import response_cache
+import extract_data_sidra
+import forecasting
+import pipeline
+import scenarios
+import serving
+import storage
+import schema
+import telemetry
 
-def arima_comercio(path_data, lags, order, average):
+def arima_comercio(path_data, lags=None, order=None, average=None, df_observed=None, criterion='aic', max_workers=None):
     """
-    Builds and fits an ARIMA model to the 'pibComercio' series,
+    Builds and fits an ARIMA model to the quarterly commerce (trade) GDP series,
     generates a forecast, and saves the resulting DataFrame.
 
     Parameters:
@@ -16,90 +25,324 @@ def arima_comercio(path_data, lags, order, average):
     - lags (int): AR term (p) in the ARIMA model.
     - order (int): Differencing term (d) in the ARIMA model.
     - average (int): MA term (q) in the ARIMA model.
+    - df_observed (pd.DataFrame): Already extracted trade GDP; fetched when not given.
+    - criterion (str), max_workers (int): Used when any of lags, order or average is None:
+      the order is then chosen by forecasting.search_arima_order ('aic' or 'oos'),
+      fitting the candidates in parallel processes, and the ranking is saved to
+      interim/arima-order-search.
 
     Returns:
-    - pd.DataFrame: Original plus forecasted 'pibComercio' data.
+    - pd.DataFrame: Original plus forecasted 'trade_gdp' data.
     """
     # Load commerce GDP data
-    pib_comercio = coleta_dados_sidra.make_pibComercio(path_data)
+    if df_observed is None:
+        df_observed = extract_data_sidra.get_ibge_trade_gdp(path_data)
+    pib_comercio = df_observed.dropna()
 
-    # Fit ARIMA model
-    model = pm.ARIMA(order=(lags, order, average)).fit(pib_comercio.pibComercio)
+    # Fit ARIMA model, searching for the order when it is not given.
+    # Fitted models are cached per order and only updated when new quarters arrive.
+    models_dir = os.path.join(path_data, 'interim', 'models')
+    if None in (lags, order, average):
+        model, search = forecasting.search_arima_order(
+            pib_comercio.trade_gdp, criterion=criterion, max_workers=max_workers
+        )
+        storage.save_frame(search, os.path.join(path_data, 'interim', 'arima-order-search'))
+        forecasting.store_fitted(model, pib_comercio.trade_gdp, model.order, models_dir)
+        telemetry.event('arima_order_selected', order=list(model.order), candidates=len(search),
+                        wall_seconds=search.attrs['wall_seconds'])
+    else:
+        model, _ = forecasting.fit_arima_cached(pib_comercio.trade_gdp, (lags, order, average), models_dir)
 
-    # Forecast next 8 periods
+    # Forecast next 8 quarters
     n_periods = 8
     forecast = model.predict(n_periods=n_periods, return_conf_int=False)
-    forecast_df = pd.DataFrame({'pibComercio': forecast}, index=pd.date_range(start=pib_comercio.index[-1] + pd.offsets.MonthBegin(), periods=n_periods, freq='MS'))
+    forecast_df = pd.DataFrame(
+        {'trade_gdp': np.asarray(forecast)},
+        index=pd.date_range(start=pib_comercio.index[-1] + pd.DateOffset(months=3), periods=n_periods, freq='3MS')
+    )
 
     # Combine actual and forecasted data
     df_combined = pd.concat([pib_comercio, forecast_df])
     df_combined = df_combined[df_combined.index >= '2013-12-01']
 
     # Save to disk
-    output_path = os.path.join(path_data, 'interim', 'df_pib_comercio_arima.pkl')
-    df_combined.to_pickle(output_path)
+    output_path = os.path.join(path_data, 'interim', 'df_pib_comercio_arima')
+    storage.save_frame(df_combined, output_path)
 
     return df_combined
 
 
-def make_dataset(path_data, lags, order, average, retries=3):
+def commerce_stage(path_data, df_observed, lags=None, order=None, average=None):
+    """
+    Pipeline entry point of arima_comercio, called with the observed trade GDP.
+    """
+    return arima_comercio(path_data, lags, order, average, df_observed)
+
+
+def fill_unemployment(dataset):
+    """
+    Carries the last observed unemployment rate forward over the missing quarters after it.
+    """
+    # Positional, since a quarter may appear in more than one row
+    column = dataset.columns.get_loc('unemployment_rate')
+    valid = np.flatnonzero(dataset['unemployment_rate'].notna().to_numpy())
+    if len(valid):
+        last = valid[-1]
+        dataset.iloc[last:, column] = dataset.iloc[last:, column].fillna(dataset.iloc[last, column])
+    return dataset
+
+
+def _row_keys(df):
+    # Quarters may repeat (observed and expected rows of the same quarter), so each row is
+    # identified by its quarter and its position among the rows of that quarter
+    return pd.MultiIndex.from_arrays([df.index, df.groupby(level=0, sort=False).cumcount().to_numpy()])
+
+
+def upsert_dataset(path_data, dataset):
+    """
+    Writes `dataset` over the stored df_projecoes by updating only the cells that differ.
+    Every revised cell is appended to processed/df_projecoes-revisions with its previous value,
+    and nothing is written when no cell changed.
+
+    Parameters:
+    - path_data (str): Path to the dataset directory.
+    - dataset (pd.DataFrame): The freshly assembled dataset.
+
+    Returns:
+    - (pd.DataFrame, pd.DataFrame) with the stored dataset after the upsert and the revisions made.
+    """
+    output_path = os.path.join(path_data, 'processed', 'df_projecoes')
+    revisions_path = os.path.join(path_data, 'processed', 'df_projecoes-revisions')
+    if storage.find_frame(output_path) is None:
+        storage.save_frame(dataset, output_path)
+        return dataset, pd.DataFrame()
+
+    stored = storage.load_frame(output_path, memory_map=False)
+    keys = _row_keys(dataset)
+    previous = stored.set_axis(_row_keys(stored)).reindex(index=keys, columns=dataset.columns)
+    new_rows = ~keys.isin(previous.index[previous.notna().any(axis=1)])
+
+    before = previous.to_numpy(dtype=float)
+    after = dataset.to_numpy(dtype=float)
+    changed = ~((before == after) | (np.isnan(before) & np.isnan(after)))
+    rows, cols = np.nonzero(changed)
+    revisions = pd.DataFrame(
+        {
+            'indicator': pd.Categorical(dataset.columns[cols], categories=dataset.columns),
+            'previous': before[rows, cols],
+            'value': after[rows, cols],
+            'revised': pd.Timestamp.now(),
+        },
+        index=pd.DatetimeIndex(dataset.index[rows], name='Quarter'),
+    )
+
+    # Rows dropped from the dataset or columns added/removed also require a rewrite
+    same_layout = len(stored) == len(dataset) and list(stored.columns) == list(dataset.columns)
+    if same_layout and revisions.empty:
+        return stored, revisions
+
+    upserted = previous.where(~changed, dataset.set_axis(keys)).set_axis(dataset.index)
+    storage.save_frame(schema.conform(upserted, 'df_projecoes'), output_path)
+    if not revisions.empty:
+        if storage.find_frame(revisions_path) is not None:
+            revisions_log = pd.concat([storage.load_frame(revisions_path, memory_map=False), revisions])
+        else:
+            revisions_log = revisions
+        storage.save_frame(revisions_log, revisions_path)
+    telemetry.event('dataset_revised', cells=len(revisions), new_quarters=int(new_rows.sum()),
+                    indicators=revisions['indicator'].unique().astype(str).tolist())
+    return storage.load_frame(output_path, memory_map=False), revisions
+
+
+def assemble_dataset(path_data, pib, family_consumption, industrial_gdp, unemployment, ipca, selic, commerce_gdp,
+                     incremental=False):
+    """
+    Joins the projected indicators on the GDP quarters, carries the last observed
+    unemployment rate forward and saves the result to the processed layer.
+    With incremental=True, only the cells that differ from the stored dataset are updated
+    (see upsert_dataset).
+
+    Returns:
+    - pd.DataFrame: The assembled dataset.
+    """
+    dataset = pd.DataFrame(index=pib.index)
+    dataset = (
+        dataset
+        .join(pib, how='left')
+        .join(family_consumption, how='left')
+        .join(industrial_gdp, how='left')
+        .join(unemployment, how='left')
+        .join(ipca, how='left')
+        .join(selic, how='left')
+        .join(commerce_gdp, how='left')
+    )
+
+    # Fill missing values in 'unemployment' after the last valid entry
+    dataset = fill_unemployment(dataset)
+    dataset = schema.conform(dataset, 'df_projecoes')
+
+    if incremental:
+        return upsert_dataset(path_data, dataset)[0]
+
+    # Save final dataset
+    output_path = os.path.join(path_data, 'processed', 'df_projecoes')
+    storage.save_frame(dataset, output_path)
+    return dataset
+
+
+def forecast_projections(path_data, dataset, periods=8, max_workers=None):
+    """
+    Extends every projected indicator past the end of its Focus expectations with a statistical
+    forecast (forecasting.forecast_batch), so all series reach the same horizon, and saves the
+    result to the processed layer. The fitting summary is saved to interim/forecast-batch.
+
+    Parameters:
+    - path_data (str): Path to the dataset directory.
+    - dataset (pd.DataFrame): The assembled df_projecoes.
+    - periods (int): Quarters added after the last quarter of the dataset.
+    - max_workers (int): Worker processes used to fit the models.
+
+    Returns:
+    - pd.DataFrame: The dataset extended to the common horizon.
+    """
+    extended, summary = forecasting.forecast_batch(dataset, periods=periods, max_workers=max_workers)
+    storage.save_frame(summary, os.path.join(path_data, 'interim', 'forecast-batch'))
+    storage.save_frame(extended, os.path.join(path_data, 'processed', 'df_projecoes_forecast'))
+    telemetry.event('forecast_batch', series=len(summary), horizon=f'{extended.index[-1]:%Y-%m}',
+                    wall_seconds=summary.attrs['wall_seconds'])
+    return extended
+
+
+def build_stages(lags, order, average, forecast_periods=8, scenario_draws=5000, incremental=False):
+    """
+    Declares the extract -> project -> assemble graph behind df_projecoes.
+
+    Parameters:
+    - lags, order, average (int): ARIMA model parameters, or None to search for the order.
+    - forecast_periods (int): Horizon of the 'forecasts' stage, in quarters after the dataset.
+    - scenario_draws (int): Paths simulated per indicator by the 'scenarios' stage.
+    - incremental (bool): Upsert the changed cells of the stored dataset instead of rewriting it.
+
+    Returns:
+    - list of pipeline.Stage
+    """
+    projections = {
+        **build_features.PROJECTIONS,
+        'commerce_gdp': (partial(commerce_stage, lags=lags, order=order, average=average), ['ibge_trade_gdp']),
+    }
+    extractions = dict.fromkeys(name for _, inputs in projections.values() for name in inputs)
+
+    stages = [pipeline.Stage(name, extraction=True) for name in extractions]
+    params = {'commerce_gdp': {'order': [lags, order, average]}}
+    stages += [
+        pipeline.Stage(name, func, deps=inputs, params=params.get(name))
+        for name, (func, inputs) in projections.items()
+    ]
+    stages.append(pipeline.Stage(
+        'dataset',
+        partial(assemble_dataset, incremental=incremental),
+        deps=['gdp', 'household_consumption', 'industrial_gdp', 'unemployment', 'ipca', 'selic', 'commerce_gdp'],
+    ))
+    stages.append(pipeline.Stage(
+        'forecasts',
+        partial(forecast_projections, periods=forecast_periods),
+        deps=['dataset'],
+        params={'periods': forecast_periods},
+    ))
+    # Reads the observed series and the Focus vintage stores rather than the dataset
+    stages.append(pipeline.Stage(
+        'scenarios',
+        partial(scenarios.scenarios_stage, draws=scenario_draws, seed=0),
+        deps=['ibge_gdp', 'ibge_household_consumption', 'ibge_industrial_gdp', 'ibge_unemployment_rate', 'ibge_ipca',
+              'selic_quarterly', 'focus_gdp', 'focus_household_consumption', 'focus_industrial_gdp',
+              'focus_unemployment', 'focus_ipca', 'focus_selic'],
+        params={'draws': scenario_draws},
+        reads=scenarios.read_versions,
+    ))
+    return stages
+
+
+def make_dataset(path_data, lags, order, average, retries=3, max_workers=8, force=False, run_id=None, resume=False,
+                 forecast_periods=None, scenario_draws=None, incremental=False, profile=False, track_memory=False):
     """
     Creates and saves the full dataset with engineered features and forecasted commerce GDP.
-    Includes retry logic in case of data download or processing failures.
+    Only the stages whose inputs changed since the previous run are recomputed.
+
+    Every completed stage is checkpointed under a run ID, so a retry resumes from the stages
+    that failed instead of starting over. If every attempt fails, the dataset is assembled from
+    the fresh stages of this run plus the last good output of the stages that failed;
+    the previously saved dataset is the final fallback.
 
     Parameters:
     - path_data (str): Base path for reading and saving data.
-    - lags, order, average (int): ARIMA model parameters.
+    - lags, order, average (int): ARIMA model parameters. Pass None to search for the order.
     - retries (int): Number of retries in case of failure.
+    - max_workers (int): Number of threads used for the concurrent extractions.
+    - force (bool): Recompute every stage even if its inputs did not change.
+    - run_id (str): Resume this run instead of starting a new one.
+    - resume (bool): Resume the most recent run that did not finish, if any.
+    - forecast_periods (int): When given, every indicator is also forecast this many quarters past
+      the dataset and saved to processed/df_projecoes_forecast (see forecast_projections).
+    - scenario_draws (int): When given, this many expectation paths are simulated per indicator and
+      their quantiles saved to processed/df_projecoes_scenarios (see scenarios.run_scenarios).
+    - incremental (bool): Update only the cells of processed/df_projecoes that changed and log
+      them to processed/df_projecoes-revisions, instead of rewriting the dataset.
+    - profile (bool): Also run every stage under cProfile and dump its statistics next to the report.
+    - track_memory (bool): Also record the peak memory of every stage (slows the run down).
+
+    When the run finishes, the new version of the processed and interim layers is published to
+    the stores serving them (see serving.ProjectionStore).
+
+    Every stage is recorded (wall time, network bytes, requests, retries, rows and, with
+    track_memory=True, peak memory) in the JSON lines report interim/telemetry/{run_id}.jsonl.
 
     Returns:
     - pd.DataFrame: The final assembled dataset.
     """
     dataset = None
+    http_session.set_cache_dir(os.path.join(path_data, 'raw', 'http'))
+    response_cache.configure(os.path.join(path_data, 'raw', 'cache'))
+    stages = build_stages(lags, order, average, forecast_periods or 8, scenario_draws or 5000, incremental)
+    graph = pipeline.Pipeline(path_data, stages)
+    targets = ['dataset'] + (['forecasts'] if forecast_periods else []) + (['scenarios'] if scenario_draws else [])
+    if run_id is None:
+        run_id = (graph.latest_incomplete_run() if resume else None) or pipeline.new_run_id()
+    telemetry_dir = os.path.join(path_data, 'interim', 'telemetry')
+    telemetry.configure(
+        os.path.join(telemetry_dir, f'{run_id}.jsonl'),
+        profile_dir=os.path.join(telemetry_dir, f'{run_id}-profiles') if profile else None,
+        memory=track_memory,
+    )
+
+    try:
+        for attempt in range(1, retries + 1):
+            try:
+                # Extract all inputs concurrently; project and assemble only what changed
+                outputs = graph.run(targets, force=force, max_workers=max_workers, run_id=run_id)
+                dataset = outputs['dataset']
+                serving.publish_version(path_data, run_id)
+                if graph.report['skipped']:
+                    telemetry.event('stages_skipped', run_id=run_id, stages=graph.report['skipped'])
+                break  # success, exit retry loop
 
-    for attempt in range(1, retries + 1):
-        try:
-            # Feature engineering
-            pib = build_features.features_pib(path_data)
-            family_consumption = build_features.features_consumoFamilias(path_data)
-            industrial_gdp = build_features.features_pibIndustrial(path_data)
-            unemployment = build_features.features_desocupacao(path_data)
-            ipca = build_features.features_ipca(path_data)
-            selic = build_features.features_selic(path_data)
-            commerce_gdp = arima_comercio(path_data, lags, order, average)
-
-            # Assemble dataset
-            dataset = pd.DataFrame(index=pib.index)
-            dataset = (
-                dataset
-                .join(pib, how='left')
-                .join(family_consumption, how='left')
-                .join(industrial_gdp, how='left')
-                .join(unemployment, how='left')
-                .join(ipca, how='left')
-                .join(selic, how='left')
-                .join(commerce_gdp, how='left')
-            )
-
-            # Fill missing values in 'unemployment' after the last valid entry
-            last_valid = dataset['desocupacao'].last_valid_index()
-            if last_valid:
-                last_value = dataset.loc[last_valid, 'desocupacao']
-                dataset.loc[last_valid:, 'desocupacao'] = dataset.loc[last_valid:, 'desocupacao'].fillna(last_value)
-
-            # Save final dataset
-            output_path = os.path.join(path_data, 'processed', 'df_projecoes.pkl')
-            dataset.to_pickle(output_path)
-            break  # success, exit retry loop
-
-        except Exception as e:
-            print(f"Attempt {attempt} failed with error: {e}")
-            if attempt == retries:
-                try:
-                    print("Loading previously saved dataset as fallback.")
-                    fallback_path = os.path.join(path_data, 'processed', 'df_projecoes.pkl')
-                    dataset = pd.read_pickle(fallback_path)
-                except Exception as final_error:
-                    raise RuntimeError("All attempts failed and no backup dataset was found.") from final_error
+            except Exception as e:
+                print(f"Attempt {attempt} failed with error: {e}")
+                telemetry.event('attempt_failed', run_id=run_id, attempt=attempt, error=str(e))
+                if attempt == retries:
+                    try:
+                        # Assemble the dataset with the last good output of the failed stages
+                        dataset = graph.run(targets, max_workers=max_workers, run_id=run_id, fallback=True)['dataset']
+                        serving.publish_version(path_data, run_id)
+                        telemetry.event('fallback', run_id=run_id, stages=graph.report['fallback'])
+                    except Exception as fallback_error:
+                        try:
+                            fallback_path = os.path.join(path_data, 'processed', 'df_projecoes')
+                            telemetry.event('fallback_saved_dataset', run_id=run_id, path=fallback_path,
+                                            error=str(fallback_error))
+                            dataset = storage.load_frame(fallback_path)
+                        except Exception as final_error:
+                            raise RuntimeError("All attempts failed and no backup dataset was found.") from final_error
+    finally:
+        telemetry.disable()
 
     return dataset
@@ -0,0 +1,123 @@
+# Runs the independent SIDRA, Olinda and SGS extractions concurrently
+# and yields each result as soon as it is available (see pipeline.Pipeline)
+# Import libraries
+import warnings
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import extract_data_bacen
+import extract_data_olinda
+import extract_data_sidra
+import telemetry
+
+warnings.filterwarnings("ignore")
+
+# Extraction name -> (source, function)
+# SGS series are updated incrementally from the copies already stored under data/raw
+EXTRACTIONS = {
+    'ibge_gdp': ('sidra', extract_data_sidra.get_ibge_gdp),
+    'ibge_household_consumption': ('sidra', extract_data_sidra.get_ibge_household_consumption),
+    'ibge_industrial_gdp': ('sidra', extract_data_sidra.get_ibge_industrial_gdp),
+    'ibge_trade_gdp': ('sidra', extract_data_sidra.get_ibge_trade_gdp),
+    'ibge_unemployment_rate': ('sidra', extract_data_sidra.get_ibge_unemployment_rate),
+    'ibge_ipca': ('sidra', extract_data_sidra.get_ibge_ipca),
+    'ibge_pmc': ('sidra', extract_data_sidra.get_ibge_pmc),
+    'focus_gdp': ('olinda', extract_data_olinda.get_focus_gdp),
+    'focus_household_consumption': ('olinda', extract_data_olinda.get_focus_household_consumption),
+    'focus_industrial_gdp': ('olinda', extract_data_olinda.get_focus_industrial_gdp),
+    'focus_commerce_gdp': ('olinda', extract_data_olinda.get_focus_commerce_gdp),
+    'focus_unemployment': ('olinda', extract_data_olinda.get_focus_unemployment),
+    'focus_ipca': ('olinda', extract_data_olinda.get_focus_ipca),
+    'focus_selic': ('olinda', extract_data_olinda.get_focus_selic),
+    'selic_quarterly': ('sgs', partial(extract_data_bacen.get_selic_quarterly, incremental=True)),
+    'credit_concession_individuals': ('sgs', partial(extract_data_bacen.get_credit_concession_individuals, incremental=True)),
+    'credit_concession_companies': ('sgs', partial(extract_data_bacen.get_credit_concession_companies, incremental=True)),
+    'avg_interest_rate_individuals': ('sgs', partial(extract_data_bacen.get_avg_interest_rate_individuals, incremental=True)),
+}
+
+# Extractions served together by one batched request:
+# batch name -> (source, function, {extraction name: indicator passed to the function})
+# Each function is called as function(path_data, indicators) and returns {indicator: DataFrame}
+BATCHES = {
+    'ibge_national_accounts': ('sidra', extract_data_sidra.get_ibge_national_accounts, {
+        'ibge_gdp': 'gdp',
+        'ibge_household_consumption': 'household_consumption',
+        'ibge_industrial_gdp': 'industrial_gdp',
+        'ibge_trade_gdp': 'trade_gdp',
+    }),
+    'focus_quarterly': ('olinda', extract_data_olinda.get_focus_quarterly, {
+        'focus_gdp': 'gdp',
+        'focus_unemployment': 'unemployment',
+    }),
+    'focus_annual': ('olinda', extract_data_olinda.get_focus_annual, {
+        'focus_household_consumption': 'household_consumption',
+        'focus_industrial_gdp': 'industrial_gdp',
+        'focus_commerce_gdp': 'commerce_gdp',
+    }),
+}
+
+# Maximum number of simultaneous requests per upstream API
+SOURCE_LIMITS = {'sidra': 2, 'olinda': 4, 'sgs': 3}
+
+
+def run_extractions(path_data, names=None, max_workers=8, source_limits=None, return_exceptions=False):
+    """
+    Runs the selected extractions in a bounded thread pool and yields them as they complete.
+    Extractions covered by BATCHES are fetched together with a single request.
+
+    Parameters:
+    - path_data: Path to store and retrieve data files.
+    - names (list): Keys of EXTRACTIONS to run. Runs all of them when not given.
+    - max_workers (int): Total number of worker threads.
+    - source_limits (dict): Per-source concurrency limits, overriding SOURCE_LIMITS.
+    - return_exceptions (bool): Yield (name, exception) for failed extractions and keep going,
+      instead of re-raising the first failure.
+
+    Yields:
+    - (name, DataFrame) tuples in completion order. By default the first failure is re-raised.
+    """
+    names = list(EXTRACTIONS) if names is None else list(names)
+    limits = {**SOURCE_LIMITS, **(source_limits or {})}
+    semaphores = {
+        source: threading.BoundedSemaphore(limit) for source, limit in limits.items()
+    }
+
+    def run(name):
+        source, func = EXTRACTIONS[name]
+        try:
+            with semaphores[source], telemetry.stage(name, f'extraction:{source}') as record:
+                result = func(path_data)
+                telemetry.set_output(record, result)
+                return {name: result}
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return {name: e}
+
+    def run_batch(batch, members):
+        source, func, indicators = BATCHES[batch]
+        try:
+            with semaphores[source], telemetry.stage(batch, f'extraction:{source}') as record:
+                frames = func(path_data, [indicators[name] for name in members])
+                telemetry.set_output(record, frames)
+            return {name: frames[indicators[name]] for name in members}
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return {name: e for name in members}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for batch, (_, _, indicators) in BATCHES.items():
+            members = [name for name in names if name in indicators]
+            if members:
+                futures.append(executor.submit(run_batch, batch, members))
+                names = [name for name in names if name not in indicators]
+        futures += [executor.submit(run, name) for name in names]
+        try:
+            for future in as_completed(futures):
+                yield from future.result().items()
+        finally:
+            for future in futures:
+                future.cancel()
+
@@ -0,0 +1,95 @@
+# Vectorized parsing of the reference period codes used by SIDRA and Olinda
+# Codes repeat a lot (one per survey, reference period or territory), so each distinct code is
+# parsed once with string and integer operations and the result is broadcast back,
+# instead of building one Timestamp per row
+# Import libraries
+import warnings
+import numpy as np
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+
+
+def _parse(codes, pattern, to_month):
+    """
+    Parses period codes into the first day of a month.
+
+    Parameters:
+    - codes: Array-like of codes (strings or integers such as years read by read_csv).
+    - pattern (str): Regex with a named group 'year' and a named group 'n'.
+    - to_month (callable): Maps the integer array of group 'n' to months (1-12).
+
+    Returns:
+    - pd.DatetimeIndex, NaT for missing or invalid codes.
+    """
+    labels, uniques = pd.factorize(pd.Series(codes, dtype=object), use_na_sentinel=True)
+    text = pd.Series(uniques, dtype=object).astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    parts = text.str.extract(pattern)
+    year = pd.to_numeric(parts['year'], errors='coerce').to_numpy(dtype=float)
+    month = to_month(pd.to_numeric(parts['n'], errors='coerce').to_numpy(dtype=float))
+    valid = ~np.isnan(year) & ~np.isnan(month) & (month >= 1) & (month <= 12)
+
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype('int64')
+    parsed = months.astype('datetime64[M]').astype('datetime64[ns]')
+    parsed[~valid] = np.datetime64('NaT')
+    # Missing codes have label -1, which picks the trailing NaT
+    return pd.DatetimeIndex(np.append(parsed, np.datetime64('NaT', 'ns'))[labels])
+
+
+def _result(dates, as_period, freq):
+    return dates.to_period(freq) if as_period else dates
+
+
+def sidra_quarter(codes, as_period=False):
+    """
+    Parses SIDRA quarters 'yyyytt' (e.g. '202401') into the first day of the quarter's last month
+    (2024-03-01), or into quarterly Periods with as_period=True.
+    """
+    dates = _parse(codes, r'^(?P<year>\d{4})(?P<n>\d{2})$', lambda quarter: quarter * 3)
+    return _result(dates, as_period, 'Q')
+
+
+def sidra_month(codes, as_period=False):
+    """
+    Parses SIDRA months 'yyyymm' (e.g. '202403') into the first day of the month.
+    """
+    dates = _parse(codes, r'^(?P<year>\d{4})(?P<n>\d{2})$', lambda month: month)
+    return _result(dates, as_period, 'M')
+
+
+def olinda_quarter(codes, as_period=False):
+    """
+    Parses Olinda quarters 't/yyyy' (e.g. '1/2024') into the first day of the quarter's last month
+    (2024-03-01), or into quarterly Periods with as_period=True.
+    """
+    dates = _parse(codes, r'^(?P<n>\d)/(?P<year>\d{4})$', lambda quarter: quarter * 3)
+    return _result(dates, as_period, 'Q')
+
+
+def olinda_month(codes, as_period=False):
+    """
+    Parses Olinda months 'mm/yyyy' (e.g. '03/2024') into the first day of the month.
+    """
+    dates = _parse(codes, r'^(?P<n>\d{1,2})/(?P<year>\d{4})$', lambda month: month)
+    return _result(dates, as_period, 'M')
+
+
+def olinda_year(codes, as_period=False):
+    """
+    Parses Olinda years 'yyyy' into December 1st of the year (2024-12-01),
+    or into annual Periods with as_period=True.
+    """
+    dates = _parse(codes, r'^(?P<year>\d{4})(?P<n>)$', lambda empty: np.full(len(empty), 12.0))
+    return _result(dates, as_period, 'Y')
+
+
+def selic_meeting_quarter(codes, as_period=False):
+    """
+    Maps the even Copom meetings of 'Rn/yyyy' codes (R2, R4, R6, R8) to the first day of the
+    last month of the quarter they close (March, June, September, December).
+    Odd meetings are NaT.
+    """
+    def to_month(meeting):
+        return np.where(meeting % 2 == 0, meeting * 3 / 2, np.nan)
+    dates = _parse(codes, r'^R(?P<n>\d)/(?P<year>\d{4})$', to_month)
+    return _result(dates, as_period, 'Q')
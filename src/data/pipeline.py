@@ -0,0 +1,327 @@
+# Declares the extract -> project -> assemble chain as a graph of stages
+# and recomputes only the stages whose inputs changed since the last run
+# Import libraries
+import warnings
+import os
+import json
+import hashlib
+import inspect
+import shutil
+import uuid
+from functools import partial
+import pandas as pd
+import orchestrator
+import storage
+import telemetry
+
+warnings.filterwarnings("ignore")
+
+
+class Stage:
+    """
+    One node of the pipeline graph.
+
+    Parameters:
+    - name (str): Unique stage name. Extraction stages use the keys of orchestrator.EXTRACTIONS.
+    - func (callable): Called as func(path_data, *outputs of deps). Not used by extraction stages.
+    - deps (list): Names of the stages whose outputs are passed to `func`, in order.
+    - params (dict): Parameters that affect the output; they are part of the fingerprint.
+    - extraction (bool): Whether the stage downloads data through the orchestrator.
+      Extraction stages always run, since their inputs live upstream.
+    - reads (callable): For stages that also read data outside the outputs of their deps:
+      called as reads(path_data), returns a JSON-serializable version of that data
+      (e.g. row counts of append-only stores), which is part of the fingerprint.
+    """
+
+    def __init__(self, name, func=None, deps=(), params=None, extraction=False, reads=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.params = params or {}
+        self.extraction = extraction
+        self.reads = reads
+
+
+def frame_fingerprint(df):
+    """
+    Returns a hash of the contents of `df` (values, index, column names and dtypes).
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in df.columns]).encode('utf-8'))
+    digest.update(json.dumps([str(t) for t in df.dtypes]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _source_hash(func):
+    # The whole module, so that editing a helper of the function also recomputes the stage
+    try:
+        source = inspect.getsource(inspect.getmodule(func))
+    except (OSError, TypeError):
+        return None
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def stage_fingerprint(stage, upstream, external=None):
+    """
+    Returns a hash of what determines the output of `stage`: its function (name, the arguments
+    bound by functools.partial and the source of its module), its parameters, the fingerprints
+    of its inputs and the version of the data it reads outside them (see Stage.reads).
+    """
+    func = stage.func
+    bound = []
+    while isinstance(func, partial):
+        bound.append({'args': [repr(arg) for arg in func.args],
+                      'keywords': {key: repr(value) for key, value in func.keywords.items()}})
+        func = func.func
+    payload = {
+        'func': f'{func.__module__}.{func.__qualname__}' if func is not None else None,
+        'bound': bound,
+        'code': _source_hash(func) if func is not None else None,
+        'params': stage.params,
+        'inputs': upstream,
+        'external': external,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def new_run_id():
+    """
+    Returns a new run identifier: the start time plus a short random suffix.
+    """
+    return f"{pd.Timestamp.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:6]}"
+
+
+class Pipeline:
+    """
+    Runs a graph of stages, skipping every stage whose fingerprint matches the previous run.
+
+    Every completed stage is also checkpointed under the run ID, so a retry or a later
+    invocation with the same run ID resumes from the stages that did not finish.
+
+    Parameters:
+    - path_data (str): Base data path, passed to every stage.
+    - stages (list): Stage objects. Dependencies must refer to stages in the list.
+    - state_dir (str): Where stage outputs, fingerprints and checkpoints are kept.
+      Defaults to {path_data}/interim/stages.
+    - keep_runs (int): Number of runs whose checkpoints are kept.
+    """
+
+    def __init__(self, path_data, stages, state_dir=None, keep_runs=5):
+        self.path_data = path_data
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_dir = state_dir or os.path.join(path_data, 'interim', 'stages')
+        self.keep_runs = keep_runs
+        self.report = {}
+        for stage in stages:
+            missing = [dep for dep in stage.deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {missing}")
+
+    @staticmethod
+    def _read_json(path, default):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    @staticmethod
+    def _write_json(path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def _state_path(self):
+        return os.path.join(self.state_dir, 'state.json')
+
+    def _output_path(self, name):
+        return os.path.join(self.state_dir, name)
+
+    def _run_dir(self, run_id):
+        return os.path.join(self.state_dir, 'runs', run_id)
+
+    def _manifest_path(self, run_id):
+        return os.path.join(self._run_dir(run_id), 'manifest.json')
+
+    def runs(self):
+        """
+        Returns the manifests of the checkpointed runs, oldest first.
+        """
+        runs_dir = os.path.join(self.state_dir, 'runs')
+        names = sorted(os.listdir(runs_dir)) if os.path.isdir(runs_dir) else []
+        manifests = [self._read_json(self._manifest_path(name), None) for name in names]
+        return sorted((manifest for manifest in manifests if manifest), key=lambda m: m['started'])
+
+    def latest_incomplete_run(self):
+        """
+        Returns the ID of the most recent run that did not finish, or None.
+        """
+        incomplete = [manifest['run_id'] for manifest in self.runs() if not manifest['complete']]
+        return incomplete[-1] if incomplete else None
+
+    def _prune_runs(self, current):
+        for manifest in self.runs()[:-self.keep_runs]:
+            if manifest['run_id'] != current:
+                shutil.rmtree(self._run_dir(manifest['run_id']), ignore_errors=True)
+
+    def _complete(self, name, df, output_hash, fingerprint, ctx, status):
+        """
+        Records a finished stage: keeps its output, checkpoints it under the run ID
+        and, when it was freshly computed, makes it the last good output.
+        """
+        ctx['outputs'][name] = df
+        ctx['hashes'][name] = output_hash
+        self.report[status].append(name)
+
+        if status in ('ran', 'extracted'):
+            os.makedirs(self.state_dir, exist_ok=True)
+            storage.save_frame(df, self._output_path(name))
+            ctx['state'][name] = {'fingerprint': fingerprint, 'output': output_hash}
+            self._write_json(self._state_path(), ctx['state'])
+
+        manifest = ctx['manifest']
+        os.makedirs(self._run_dir(manifest['run_id']), exist_ok=True)
+        storage.save_frame(df, os.path.join(self._run_dir(manifest['run_id']), name))
+        manifest['stages'][name] = {'output': output_hash, 'status': status}
+        self._write_json(self._manifest_path(manifest['run_id']), manifest)
+
+    def _last_good(self, name, ctx):
+        previous = ctx['state'].get(name, {})
+        df = storage.load_frame(self._output_path(name))
+        return df, previous['output']
+
+    def _run_stage(self, stage, ctx, force, fallback):
+        upstream = {dep: ctx['hashes'][dep] for dep in stage.deps}
+        external = stage.reads(self.path_data) if stage.reads is not None else None
+        fingerprint = stage_fingerprint(stage, upstream, external)
+        previous = ctx['state'].get(stage.name, {})
+
+        if not force and previous.get('fingerprint') == fingerprint:
+            try:
+                df = storage.load_frame(self._output_path(stage.name))
+                self._complete(stage.name, df, previous['output'], fingerprint, ctx, 'skipped')
+                telemetry.event('stage_skipped', stage=stage.name)
+                return
+            except (FileNotFoundError, KeyError):
+                pass
+
+        try:
+            with telemetry.stage(stage.name, 'stage') as record:
+                df = stage.func(self.path_data, *(ctx['outputs'][dep] for dep in stage.deps))
+                telemetry.set_output(record, df)
+        except Exception as e:
+            self._fail(stage.name, e, ctx, fallback)
+            return
+        self._complete(stage.name, df, frame_fingerprint(df), fingerprint, ctx, 'ran')
+
+    def _fail(self, name, error, ctx, fallback):
+        """
+        Records a failed stage. With `fallback`, its last good output is used instead when available.
+        """
+        if fallback:
+            try:
+                df, output_hash = self._last_good(name, ctx)
+                self._complete(name, df, output_hash, None, ctx, 'fallback')
+                return
+            except (FileNotFoundError, KeyError):
+                pass
+        ctx['errors'][name] = error
+        self.report['failed'].append(name)
+
+    def run(self, targets=None, force=False, max_workers=8, source_limits=None, run_id=None, fallback=False):
+        """
+        Runs the stages needed for `targets` (all stages when not given).
+        Extractions run concurrently; every other stage runs as soon as its inputs are ready,
+        or is loaded from the previous run when its fingerprint did not change.
+
+        Parameters:
+        - targets (list): Names of the stages whose outputs are wanted.
+        - force (bool): Recompute every stage regardless of fingerprints.
+        - max_workers (int), source_limits (dict): Passed to orchestrator.run_extractions.
+        - run_id (str): Checkpoint run ID. Stages already completed under this ID are loaded
+          from their checkpoints instead of running again. A new ID is created when not given.
+        - fallback (bool): Replace failed stages with their last good output when there is one.
+
+        Returns:
+        - dict mapping stage names to their outputs. self.report lists the run ID and what was
+          resumed, extracted, ran, skipped, replaced by the fallback or failed.
+
+        Raises:
+        - RuntimeError when a stage failed (and had no fallback); every stage that did not
+          depend on it still ran and was checkpointed.
+        """
+        needed = []
+        pending_names = list(targets) if targets is not None else list(self.stages)
+        while pending_names:
+            name = pending_names.pop()
+            if name not in needed:
+                needed.append(name)
+                pending_names.extend(self.stages[name].deps)
+
+        run_id = run_id or new_run_id()
+        manifest = self._read_json(self._manifest_path(run_id), None) or {
+            'run_id': run_id, 'started': f'{pd.Timestamp.now():%Y-%m-%dT%H:%M:%S}', 'complete': False, 'stages': {},
+        }
+        self.report = {
+            'run_id': run_id, 'resumed': [], 'extracted': [], 'ran': [], 'skipped': [], 'fallback': [], 'failed': [],
+        }
+        ctx = {
+            'state': self._read_json(self._state_path(), {}),
+            'manifest': manifest, 'outputs': {}, 'hashes': {}, 'errors': {},
+        }
+
+        # Resume: reuse whatever this run already completed
+        for name in needed:
+            checkpoint = manifest['stages'].get(name)
+            if checkpoint:
+                try:
+                    ctx['outputs'][name] = storage.load_frame(os.path.join(self._run_dir(run_id), name))
+                    ctx['hashes'][name] = checkpoint['output']
+                    self.report['resumed'].append(name)
+                except FileNotFoundError:
+                    del manifest['stages'][name]
+
+        pending = [name for name in needed if not self.stages[name].extraction and name not in ctx['outputs']]
+
+        def run_ready():
+            progress = True
+            while progress:
+                progress = False
+                for name in list(pending):
+                    deps = self.stages[name].deps
+                    if any(dep in ctx['errors'] for dep in deps):
+                        ctx['errors'][name] = RuntimeError(f"Upstream stage failed for '{name}'.")
+                        pending.remove(name)
+                        progress = True
+                    elif all(dep in ctx['outputs'] for dep in deps):
+                        self._run_stage(self.stages[name], ctx, force, fallback)
+                        pending.remove(name)
+                        progress = True
+
+        run_ready()
+        extractions = [
+            name for name in needed if self.stages[name].extraction and name not in ctx['outputs']
+        ]
+        for name, result in orchestrator.run_extractions(
+            self.path_data, extractions, max_workers, source_limits, return_exceptions=True
+        ):
+            if isinstance(result, Exception):
+                self._fail(name, result, ctx, fallback)
+            else:
+                self._complete(name, result, frame_fingerprint(result), None, ctx, 'extracted')
+            run_ready()
+
+        failed = {name: error for name, error in ctx['errors'].items() if name in self.report['failed']}
+        if failed:
+            first = next(iter(failed.values()))
+            raise RuntimeError(
+                f"Run {run_id} failed at stages {list(failed)}: {first}"
+            ) from first
+
+        manifest['complete'] = True
+        self._write_json(self._manifest_path(run_id), manifest)
+        self._prune_runs(run_id)
+        return ctx['outputs']
@@ -0,0 +1,228 @@
+# Local on-disk cache for the responses of the SIDRA, Olinda and SGS APIs
+# Entries are addressed by a hash of the normalized request, expire after a per-source TTL
+# and are evicted least-recently-used first once the cache grows beyond its byte budget
+# Import libraries
+import warnings
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import telemetry
+
+warnings.filterwarnings("ignore")
+
+# Seconds an entry stays fresh, per source
+DEFAULT_TTL = {'sidra': 6 * 3600, 'olinda': 3600, 'sgs': 3600}
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds between writes of the index when only access times changed (cache hits);
+# pending access times are also written when the process exits
+INDEX_SAVE_INTERVAL = 5.0
+
+
+def normalize_url(url):
+    """
+    Returns `url` with a lowercase scheme and host and its query parameters sorted,
+    so equivalent requests share a cache entry.
+    """
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+def request_key(source, url=None, params=None):
+    """
+    Builds the cache key of a request from its source and either its URL or its parameters.
+    """
+    if url is not None:
+        normalized = normalize_url(url)
+    else:
+        normalized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(f'{source}\n{normalized}'.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of response bodies stored under `cache_dir`.
+
+    Parameters:
+    - cache_dir (str): Directory for the entries. The cache is disabled when None.
+    - max_bytes (int): Total size above which least-recently-used entries are evicted.
+    - ttl (dict): Seconds an entry stays fresh, per source. Sources not listed never expire.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = {**DEFAULT_TTL, **(ttl or {})}
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._index = None
+        self._dirty = False
+        self._saved_at = 0.0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            atexit.register(self.flush)
+
+    @property
+    def enabled(self):
+        return bool(self.cache_dir)
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load_index(self):
+        if self._index is None:
+            try:
+                with open(self._index_path(), encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        tmp = f'{self._index_path()}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self._index_path())
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        try:
+            os.remove(self._entry_path(key))
+        except OSError:
+            pass
+
+    def get(self, source, key):
+        """
+        Returns the cached body for `key` as bytes, or None when it is missing or expired.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(key)
+            ttl = self.ttl.get(source)
+            if entry and ttl is not None and time.time() - entry['created'] > ttl:
+                self._remove(key)
+                entry = None
+            if entry:
+                try:
+                    with open(self._entry_path(key), 'rb') as f:
+                        data = f.read()
+                except OSError:
+                    self._remove(key)
+                    entry = None
+            if not entry:
+                self.stats['misses'] += 1
+                return None
+            entry['accessed'] = time.time()
+            self.stats['hits'] += 1
+            # Keep the LRU order across processes even on runs where every request is a hit
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= INDEX_SAVE_INTERVAL:
+                self._save_index()
+            return data
+
+    def put(self, source, key, data):
+        """
+        Stores `data` (bytes) under `key` and evicts least-recently-used entries
+        until the cache fits in max_bytes.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            index = self._load_index()
+            path = self._entry_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            now = time.time()
+            index[key] = {'source': source, 'size': len(data), 'created': now, 'accessed': now}
+
+            total = sum(entry['size'] for entry in index.values())
+            for old_key in sorted(index, key=lambda k: index[k]['accessed']):
+                if total <= self.max_bytes or old_key == key:
+                    break
+                total -= index[old_key]['size']
+                self._remove(old_key)
+                self.stats['evictions'] += 1
+            self._save_index()
+
+    def flush(self):
+        """
+        Writes the access times of the entries read since the index was last saved.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def clear(self):
+        """
+        Removes every entry and resets the counters.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for key in list(self._load_index()):
+                self._remove(key)
+            self._save_index()
+            self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+CACHE = ResponseCache()
+
+
+def configure(cache_dir, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+    """
+    Replaces the module-level cache used by the extractors.
+    """
+    global CACHE
+    CACHE = ResponseCache(cache_dir, max_bytes, ttl)
+    return CACHE
+
+
+def cached_text(source, url, fetch):
+    """
+    Returns the body of `url` from the cache, calling `fetch()` and caching its result on a miss.
+    """
+    key = request_key(source, url=url)
+    data = CACHE.get(source, key)
+    if data is not None:
+        telemetry.count('cache_hits')
+        return data.decode('utf-8')
+    text = fetch()
+    CACHE.put(source, key, text.encode('utf-8'))
+    return text
+
+
+def cached_json(source, params, fetch, count_bytes=False):
+    """
+    Returns a JSON-serializable response identified by `params` from the cache,
+    calling `fetch()` and caching its result on a miss.
+    With count_bytes=True, the size of the serialized result of a miss is added to the
+    'bytes' telemetry counter (for sources whose client hides the response body).
+    """
+    key = request_key(source, params=params)
+    data = CACHE.get(source, key)
+    if data is not None:
+        telemetry.count('cache_hits')
+        return json.loads(data)
+    result = fetch()
+    payload = json.dumps(result).encode('utf-8')
+    if count_bytes:
+        telemetry.count('bytes', len(payload))
+    CACHE.put(source, key, payload)
+    return result
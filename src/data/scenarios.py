@@ -0,0 +1,215 @@
+# Monte Carlo scenarios of the projected indicators
+# Instead of the Focus median alone, thousands of expectation paths are drawn from the dispersion
+# published with every expectation (standard deviation, minimum and maximum across respondents),
+# pushed through the same rules as build_features in a single (draws x periods) array operation,
+# and summarized as fan-chart quantiles per quarter
+# Import libraries
+import warnings
+import os
+import numpy as np
+import pandas as pd
+from scipy.interpolate import interp1d
+import build_features
+import focus_vintages
+import periods
+import schema
+import storage
+
+warnings.filterwarnings("ignore")
+
+# Indicator -> (Olinda endpoint, Olinda indicator, reference parser, raw file and column observed,
+#               rule, frequency of the observations)
+# Rules: 'growth' compounds year-over-year (quarterly) or month-over-month (monthly) expectations
+# onto the observed index like build_features; 'annual' does the same with yearly expectations
+# placed in December and interpolates the quarters in between; 'level' uses the expectations as
+# the values themselves
+INDICATORS = {
+    'gdp': ('ExpectativasMercadoTrimestrais', 'PIB Total', periods.olinda_quarter,
+            'ibge-gdp-quarterly', 'gdp', 'growth', 'Q'),
+    'household_consumption': ('ExpectativasMercadoAnuais', 'PIB Despesa de consumo das famílias', periods.olinda_year,
+                              'ibge-household-consumption-quarterly', 'household_consumption', 'annual', 'Q'),
+    'industrial_gdp': ('ExpectativasMercadoAnuais', 'PIB Indústria', periods.olinda_year,
+                       'ibge-industrial-gdp-quarterly', 'industrial_gdp', 'annual', 'Q'),
+    'unemployment_rate': ('ExpectativasMercadoTrimestrais', 'Taxa de desocupação', periods.olinda_quarter,
+                          'ibge-unemployment-rate-quarterly', 'unemployment_rate', 'level', 'Q'),
+    'ipca': ('ExpectativaMercadoMensais', 'IPCA', periods.olinda_month,
+             'ibge-ipca-monthly', 'ipca', 'growth', 'M'),
+    'selic_rate': ('ExpectativasMercadoSelic', 'Selic', periods.selic_meeting_quarter,
+                   'selic-rate-quarterly', 'selic_rate', 'level', 'Q'),
+}
+
+STATISTICS = ('Mediana', 'DesvioPadrao', 'Minimo', 'Maximo', 'numeroRespondentes')
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Observed periods kept before the projected ones: enough bases for the compounding
+# and knots for the interpolation of the annual indicators
+HISTORY = 20
+
+
+def draw_expectations(stats, draws, correlation=0.5, rng=None):
+    """
+    Draws expectation paths from the Focus statistics of several reference periods.
+
+    Each draw is the median plus the standard deviation times a standard normal shock, clipped
+    to the range of the answers [Minimo, Maximo]. The shocks of one draw are correlated across
+    reference periods: a respondent optimistic about one period tends to be about the next.
+    References without a standard deviation (or with a single respondent) are drawn at the median.
+
+    Parameters:
+    - stats (pd.DataFrame): One row per reference period with the columns of STATISTICS.
+    - draws (int): Number of paths.
+    - correlation (float): Correlation between the shocks of two reference periods (0 to 1).
+    - rng (np.random.Generator): Source of the shocks.
+
+    Returns:
+    - np.ndarray of shape (draws, len(stats)).
+    """
+    rng = rng or np.random.default_rng()
+    median = stats['Mediana'].to_numpy(dtype=float)
+    sd = stats['DesvioPadrao'].to_numpy(dtype=float) if 'DesvioPadrao' in stats else np.zeros(len(stats))
+    if 'numeroRespondentes' in stats:
+        sd = np.where(stats['numeroRespondentes'].to_numpy(dtype=float) > 1, sd, 0.0)
+    sd = np.nan_to_num(sd)
+
+    common = rng.standard_normal((draws, 1))
+    own = rng.standard_normal((draws, len(stats)))
+    shocks = np.sqrt(correlation) * common + np.sqrt(1 - correlation) * own
+    values = median + sd * shocks
+
+    low = stats['Minimo'].to_numpy(dtype=float) if 'Minimo' in stats else np.full(len(stats), np.nan)
+    high = stats['Maximo'].to_numpy(dtype=float) if 'Maximo' in stats else np.full(len(stats), np.nan)
+    return np.clip(values, np.where(np.isnan(low), -np.inf, low), np.where(np.isnan(high), np.inf, high))
+
+
+def latest_statistics(path_data, indicator, as_of=None):
+    """
+    Latest Focus statistics of an INDICATORS entry, one row per reference date, from the vintage store.
+
+    Returns:
+    - pd.DataFrame indexed by reference date (yyyy-mm-01) with the columns of STATISTICS found.
+    """
+    endpoint, name, parse = INDICATORS[indicator][:3]
+    stored = focus_vintages.load_vintages(path_data, endpoint)
+    columns = tuple(column for column in STATISTICS if column in stored.columns)
+    rows = focus_vintages.expectations_as_of(
+        path_data, endpoint, name, as_of or pd.Timestamp.today(), columns=columns
+    )
+    rows = rows.set_index(parse(rows['reference']))[list(columns)]
+    rows = rows[rows.index.notna() & rows['Mediana'].notna()]
+    return rows.sort_index()
+
+
+def simulate_indicator(observed, stats, rule, freq, draws=5000, correlation=0.5, rng=None):
+    """
+    Simulates the paths of one indicator.
+
+    Parameters:
+    - observed (pd.Series): Observed values, indexed by month-start dates.
+    - stats (pd.DataFrame): Focus statistics by reference date (see latest_statistics).
+    - rule (str): 'growth', 'annual' or 'level' (see INDICATORS).
+    - freq (str): 'Q' for quarterly or 'M' for monthly observations.
+    - draws, correlation, rng: See draw_expectations.
+
+    Returns:
+    - (pd.DatetimeIndex, np.ndarray) with the projected dates and the (draws, dates) simulated values.
+
+    Raises:
+    - ValueError when there is no observed value to project from.
+    """
+    observed = observed.dropna().sort_index()
+    if observed.empty:
+        raise ValueError(f"No observed values of '{observed.name}' to simulate from.")
+    step = 3 if freq == 'Q' else 1
+    stats = stats[stats.index > observed.index[-1]]
+    if stats.empty:
+        return pd.DatetimeIndex([]), np.empty((draws, 0))
+
+    start = observed.index[-1] - pd.DateOffset(months=step * (HISTORY - 1))
+    grid = pd.date_range(max(start, observed.index[0]), stats.index[-1], freq=f'{step}MS')
+    values = observed.reindex(grid).to_numpy(dtype=float)
+    positions = grid.get_indexer(stats.index)
+    stats, positions = stats[positions >= 0], positions[positions >= 0]
+
+    expectations = np.full((draws, len(grid)), np.nan)
+    expectations[:, positions] = draw_expectations(stats, draws, correlation, rng)
+
+    if rule == 'level':
+        paths = np.where(np.isnan(values), expectations, values)
+    else:
+        # Year-over-year bases on the quarterly grid, month-over-month on the monthly one
+        paths = build_features.compound_projection(
+            np.broadcast_to(values, expectations.shape), expectations, lag=4 if freq == 'Q' else 1)
+    if rule == 'annual':
+        # Quarters between the projected Decembers, as in the cubic interpolation of build_features
+        known = ~np.isnan(paths).any(axis=0)
+        spline = interp1d(np.flatnonzero(known), paths[:, known], kind='cubic', axis=1,
+                          bounds_error=False, fill_value=np.nan)
+        missing = np.flatnonzero(~known)
+        paths[:, missing] = spline(missing)
+
+    projected = np.isnan(values)
+    return grid[projected], paths[:, projected]
+
+
+def quantile_frame(dates, paths, quantiles=QUANTILES):
+    """
+    Fan-chart quantiles of simulated paths, one row per date and one column per quantile ('p05', ...).
+    Monthly dates are reduced to the quarter-end months (March, June, September, December).
+    """
+    quarter_end = dates.month % 3 == 0
+    dates, paths = dates[quarter_end], paths[:, quarter_end]
+    table = np.nanquantile(paths, quantiles, axis=0).T if paths.size else np.empty((0, len(quantiles)))
+    return pd.DataFrame(table, index=pd.DatetimeIndex(dates, name='Quarter'),
+                        columns=[f'p{round(q * 100):02d}' for q in quantiles])
+
+
+def run_scenarios(path_data, draws=5000, indicators=None, quantiles=QUANTILES, correlation=0.5, seed=None,
+                  as_of=None):
+    """
+    Simulates every indicator from the latest raw observations and Focus statistics and saves the
+    fan-chart quantiles to processed/df_projecoes_scenarios.
+
+    Parameters:
+    - path_data (str): Path to the dataset directory.
+    - draws (int): Paths simulated per indicator.
+    - indicators (list): Keys of INDICATORS; all by default.
+    - quantiles (tuple): Quantiles reported per quarter.
+    - correlation (float): Correlation of the shocks across reference periods (see draw_expectations).
+    - seed (int): Seed of the random generator, for reproducible scenarios.
+    - as_of: Use the Focus statistics known on this date instead of the latest ones.
+
+    Returns:
+    - pd.DataFrame indexed by quarter with an 'indicator' column and one column per quantile.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for indicator in (indicators or list(INDICATORS)):
+        _, _, _, filename, column, rule, freq = INDICATORS[indicator]
+        observed = storage.load_frame(os.path.join(path_data, 'raw', filename), columns=[column])[column]
+        stats = latest_statistics(path_data, indicator, as_of)
+        dates, paths = simulate_indicator(observed, stats, rule, freq, draws, correlation, rng)
+        frames.append(quantile_frame(dates, paths, quantiles).assign(indicator=indicator))
+
+    result = pd.concat(frames)
+    result = result[['indicator', *result.columns.drop('indicator')]]
+    result = schema.conform(result, 'df_projecoes_scenarios')
+    storage.save_frame(result, os.path.join(path_data, 'processed', 'df_projecoes_scenarios'))
+    return result
+
+
+def scenarios_stage(path_data, *inputs, draws=5000, seed=0):
+    """
+    Pipeline entry point of run_scenarios. The inputs are the outputs of the extractions of the
+    observed series and Focus expectations it reads from the raw layer; they are not used
+    directly, but make the stage run after those extractions and whenever one of them changes.
+    """
+    return run_scenarios(path_data, draws, seed=seed)
+
+
+def read_versions(path_data):
+    """
+    Versions of the Focus vintage stores read by run_scenarios (see pipeline.Stage.reads).
+    """
+    endpoints = sorted({endpoint for endpoint, *_ in INDICATORS.values()})
+    return {endpoint: focus_vintages.store_version(path_data, endpoint) for endpoint in endpoints}
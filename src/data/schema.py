@@ -0,0 +1,84 @@
+# Compact typed schemas of the frames kept in the raw, interim and processed layers
+# Frames are converted when they are created (at the extraction and assembly boundaries) and
+# again when they are loaded, so files written before a schema change are read the same way
+# Import libraries
+import warnings
+import pandas as pd
+
+warnings.filterwarnings("ignore")
+
+# Index levels and rates carry at most a few significant digits, so float32 keeps them exactly
+# to the precision published; credit volumes (millions with cents) stay float64
+FLOAT = 'float32'
+
+# File name -> index name and column dtypes
+SCHEMAS = {
+    # raw: IBGE
+    'ibge-gdp-quarterly': {'index': 'Quarter', 'columns': {'gdp': FLOAT}},
+    'ibge-household-consumption-quarterly': {'index': 'Quarter', 'columns': {'household_consumption': FLOAT}},
+    'ibge-industrial-gdp-quarterly': {'index': 'Quarter', 'columns': {'industrial_gdp': FLOAT}},
+    'ibge-trade-gdp-quarterly': {'index': 'Quarter', 'columns': {'trade_gdp': FLOAT}},
+    'ibge-unemployment-rate-quarterly': {'index': 'Quarter', 'columns': {'unemployment_rate': FLOAT}},
+    'ibge-ipca-monthly': {'index': 'Month', 'columns': {'ipca': FLOAT}},
+    'ibge-pmc-monthly': {'index': 'Month', 'columns': {'pmc': FLOAT}},
+    # raw: Focus
+    'focus-gdp-quarterly': {'index': 'Quarter', 'columns': {'gdp_median_expectation': FLOAT}},
+    'focus-unemployment-quarterly': {'index': 'Quarter', 'columns': {'unemployment_expectation': FLOAT}},
+    'focus-household-consumption-annual': {'index': 'Date', 'columns': {'household_consumption_expectation': FLOAT}},
+    'focus-industrial-gdp-annual': {'index': 'Date', 'columns': {'industrial_gdp_expectation': FLOAT}},
+    'focus-commerce-gdp-annual': {'index': 'Date', 'columns': {'commerce_gdp_expectation': FLOAT}},
+    'focus-ipca-monthly': {'index': 'Month', 'columns': {'ipca_expectation': FLOAT}},
+    'focus-selic-quarterly': {'index': 'Quarter', 'columns': {'Mediana': FLOAT}},
+    # raw: SGS
+    'selic-rate-daily': {'index': 'data', 'columns': {'valor': FLOAT}},
+    'selic-rate-quarterly': {'index': 'Quarter', 'columns': {'selic_rate': FLOAT}},
+    'credit-concession-individuals': {'index': 'data', 'columns': {'credit_concession_individuals_million': 'float64'}},
+    'credit-concession-companies': {'index': 'data', 'columns': {'credit_concession_companies_million': 'float64'}},
+    'avg-interest-rate-individuals': {'index': 'data', 'columns': {'avg_interest_rate_individuals': FLOAT}},
+    # interim
+    'gdp-quarterly': {'index': 'Quarter', 'columns': {'gdp': FLOAT}},
+    'household_consumption-quarterly': {'columns': {'household_consumption': FLOAT}},
+    'industrial_gdp-quarterly': {'columns': {'industrial_gdp': FLOAT}},
+    'unemployment-quarterly': {'index': 'Quarter', 'columns': {'unemployment_rate': FLOAT}},
+    'ipca-quarterly': {'index': 'Quarter', 'columns': {'ipca': FLOAT}},
+    'selic-quarterly': {'columns': {'selic_rate': FLOAT}},
+    'df_pib_comercio_arima': {'columns': {'trade_gdp': FLOAT}},
+}
+
+# processed: the projected indicators, with and without the statistical extension
+PROJECTED = ['gdp', 'household_consumption', 'industrial_gdp', 'unemployment_rate', 'ipca', 'selic_rate', 'trade_gdp']
+SCHEMAS['df_projecoes'] = {'columns': dict.fromkeys(PROJECTED, FLOAT)}
+SCHEMAS['df_projecoes_forecast'] = {'columns': dict.fromkeys(PROJECTED, FLOAT)}
+SCHEMAS['df_projecoes-revisions'] = {
+    'index': 'Quarter',
+    'columns': {'indicator': 'category', 'previous': FLOAT, 'value': FLOAT},
+}
+SCHEMAS['df_projecoes_scenarios'] = {
+    'index': 'Quarter',
+    'columns': {'indicator': 'category', **dict.fromkeys(['p05', 'p25', 'p50', 'p75', 'p95'], FLOAT)},
+}
+
+
+def conform(df, name):
+    """
+    Converts `df` to the schema registered under `name` (the file name it is saved under):
+    a datetime64 index with the expected name and compact column dtypes. Columns not in the
+    schema are kept as they are; frames without a schema are returned unchanged.
+    """
+    spec = SCHEMAS.get(name)
+    if spec is None:
+        return df
+    dtypes = {
+        column: dtype for column, dtype in spec['columns'].items()
+        if column in df.columns and df[column].dtype != dtype
+    }
+    index_name = spec.get('index', df.index.name)
+    index_ok = isinstance(df.index, pd.DatetimeIndex) and df.index.name == index_name
+    if not dtypes and index_ok:
+        return df
+
+    df = df.astype(dtypes) if dtypes else df.copy()
+    if not index_ok:
+        df.index = pd.DatetimeIndex(df.index, name=index_name)
+    return df
+
@@ -0,0 +1,340 @@
+# In-memory read API for the processed and interim layers
+# Dashboards and models read df_projecoes and the interim series from a store that loads every
+# frame once, answers column and date-range slices from memory and swaps to the new version
+# as a whole when make_dataset finishes a run, instead of each consumer deserializing the files
+# Import libraries
+import warnings
+import os
+import json
+import shutil
+import threading
+import time
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode
+from urllib.request import urlopen
+import pandas as pd
+import storage
+
+warnings.filterwarnings("ignore")
+
+# Layers served; frames are addressed as '{layer}/{name}', e.g. 'processed/df_projecoes'
+LAYERS = ('processed', 'interim')
+
+# Written by make_dataset when a run finishes; a new version is loaded when it changes
+VERSION_FILE = 'VERSION.json'
+
+# Published versions are kept under processed/versions/{run_id}/{layer}/, apart from the files
+# the next run overwrites; the latest KEEP_VERSIONS are kept for stores still loading an older one
+VERSIONS_DIR = 'versions'
+KEEP_VERSIONS = 3
+
+
+def version_path(path_data):
+    return os.path.join(path_data, 'processed', VERSION_FILE)
+
+
+def versions_dir(path_data):
+    return os.path.join(path_data, 'processed', VERSIONS_DIR)
+
+
+def _link_or_copy(source, target):
+    # A hard link is enough: save_frame replaces files instead of writing into them,
+    # so the linked file keeps the content it had when it was published
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _prune_versions(path_data, keep):
+    folder = versions_dir(path_data)
+    published = sorted(
+        (entry for entry in os.listdir(folder)
+         if os.path.isdir(os.path.join(folder, entry)) and not entry.endswith('.tmp')),
+        key=lambda entry: (os.path.getmtime(os.path.join(folder, entry)), entry),
+    )
+    for entry in published[:-keep]:
+        shutil.rmtree(os.path.join(folder, entry), ignore_errors=True)
+
+
+def publish_version(path_data, run_id):
+    """
+    Publishes the current files of the processed and interim layers as version `run_id`:
+    they are linked (or copied) into their own directory, which is then named in the marker,
+    so stores reading `path_data` swap to a set of files that later runs never modify.
+    The marker is replaced atomically.
+    """
+    target = os.path.join(versions_dir(path_data), str(run_id))
+    staging = f'{target}.{os.getpid()}.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    for name, path in _stored_frames(path_data).items():
+        source = storage.find_frame(path)
+        os.makedirs(os.path.join(staging, os.path.dirname(name)), exist_ok=True)
+        _link_or_copy(source, os.path.join(staging, name + os.path.splitext(source)[1]))
+    os.makedirs(staging, exist_ok=True)
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(staging, target)
+
+    path = version_path(path_data)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({
+            'run_id': run_id, 'published': time.time(), 'directory': os.path.join(VERSIONS_DIR, str(run_id)),
+        }, f)
+    os.replace(tmp, path)
+    _prune_versions(path_data, KEEP_VERSIONS)
+
+
+def _stored_frames(root):
+    frames = {}
+    for layer in LAYERS:
+        folder = os.path.join(root, layer)
+        if not os.path.isdir(folder):
+            continue
+        for entry in sorted(os.listdir(folder)):
+            base, ext = os.path.splitext(entry)
+            if ext in storage.EXTENSIONS.values() and os.path.isfile(os.path.join(folder, entry)):
+                frames.setdefault(f'{layer}/{base}', os.path.join(folder, base))
+    return frames
+
+
+class Snapshot:
+    """
+    One version of the served frames, fully loaded in memory and never modified.
+
+    Parameters:
+    - root (str): Directory with the layer folders: a published version directory, or the data
+      path itself when no version has been published yet.
+    - version: Run id of the version.
+    """
+
+    def __init__(self, root, version):
+        self.version = version
+        self.loaded = time.time()
+        self.frames = {}
+        for name, path in _stored_frames(root).items():
+            df = storage.load_frame(path, memory_map=False)
+            if isinstance(df.index, pd.DatetimeIndex) and not df.index.is_monotonic_increasing:
+                df = df.sort_index(kind='stable')
+            self.frames[name] = df
+
+
+class ProjectionStore:
+    """
+    In-process client: serves the frames of the processed and interim layers of `path_data`
+    from memory.
+
+    Every read uses the current snapshot; refresh() loads a new one while readers keep using the
+    current one and replaces it in a single assignment, so a reader sees either the old or the new
+    version of all frames, never a mix or a half-written file.
+
+    Parameters:
+    - path_data (str): Base path of the data layers.
+    - check_interval (float): Minimum seconds between checks of the version marker on reads.
+    """
+
+    def __init__(self, path_data, check_interval=1.0):
+        self.path_data = path_data
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _current_version(self):
+        """
+        (run id, directory of its files) of the published version; (None, path_data) before the first.
+        """
+        try:
+            with open(version_path(self.path_data), encoding='utf-8') as f:
+                marker = json.load(f)
+        except (OSError, ValueError):
+            return None, self.path_data
+        directory = marker.get('directory')
+        root = os.path.join(self.path_data, 'processed', directory) if directory else self.path_data
+        return marker.get('run_id'), root
+
+    def refresh(self, force=False, blocking=True):
+        """
+        Loads the published version if it differs from the one served. Returns True when swapped.
+        With blocking=False, returns False at once if another thread is already refreshing.
+        """
+        if not self._lock.acquire(blocking=blocking):
+            return False
+        try:
+            self._checked = time.monotonic()
+            version, root = self._current_version()
+            if not force and self._snapshot is not None and self._snapshot.version == version:
+                return False
+            try:
+                snapshot = Snapshot(root, version)
+            except FileNotFoundError:
+                # The version was pruned while loading: a newer marker is already in place
+                if self._snapshot is None:
+                    raise
+                return False
+            self._snapshot = snapshot
+            return True
+        finally:
+            self._lock.release()
+
+    @property
+    def snapshot(self):
+        # Readers never wait for a reload in progress: they keep the current version meanwhile
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.refresh(blocking=False)
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    def names(self):
+        """
+        Names of the frames served, e.g. ['processed/df_projecoes', 'interim/gdp-quarterly', ...].
+        """
+        return list(self.snapshot.frames)
+
+    def frame(self, name, columns=None, start=None, end=None):
+        """
+        Returns a slice of a served frame.
+
+        Parameters:
+        - name (str): '{layer}/{name}', or a processed frame name alone (e.g. 'df_projecoes').
+        - columns (list): Columns to return; all by default.
+        - start, end: Inclusive bounds on the index (dates).
+
+        Returns:
+        - pd.DataFrame, a copy that the caller may modify.
+
+        Raises:
+        - KeyError when the frame or a column is not served.
+        """
+        frames = self.snapshot.frames
+        df = frames.get(name, frames.get(f'processed/{name}'))
+        if df is None:
+            raise KeyError(f"Frame '{name}' is not served. Options: {sorted(frames)}")
+        if start is not None or end is not None:
+            df = df.loc[start:end]
+        if columns is not None:
+            missing = [column for column in columns if column not in df.columns]
+            if missing:
+                raise KeyError(f"Columns {missing} not found in '{name}'.")
+            df = df[list(columns)]
+        return df.copy()
+
+
+#-----------------------
+# HTTP service
+
+def _query_args(query):
+    columns = query.get('columns', [None])[0]
+    return {
+        'columns': columns.split(',') if columns else None,
+        'start': query.get('start', [None])[0] or None,
+        'end': query.get('end', [None])[0] or None,
+    }
+
+
+class ProjectionServer:
+    """
+    Local HTTP service over a ProjectionStore.
+
+    GET /frames                                        -> JSON list of frame names and the version
+    GET /frames/{layer}/{name}?columns=a,b&start=&end= -> JSON slice (pandas 'split' orientation)
+
+    Used as a context manager, it serves from a background thread.
+
+    Parameters:
+    - store (ProjectionStore): Frames served.
+    - host, port: Address; port 0 picks a free port.
+    """
+
+    def __init__(self, store, host='127.0.0.1', port=0):
+        self.store = store
+        self.host = host
+        self.port = port
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def answer(self, path):
+        """
+        Returns (status, body bytes) for a request path.
+        """
+        parts = urlsplit(path)
+        route = parts.path.strip('/')
+        if route == 'frames':
+            body = {'version': self.store.version, 'frames': self.store.names()}
+            return 200, json.dumps(body).encode('utf-8')
+        if not route.startswith('frames/'):
+            return 404, json.dumps({'error': f"Unknown path '{parts.path}'"}).encode('utf-8')
+        try:
+            df = self.store.frame(route[len('frames/'):], **_query_args(parse_qs(parts.query)))
+        except KeyError as e:
+            return 404, json.dumps({'error': str(e)}).encode('utf-8')
+        except (TypeError, ValueError) as e:
+            return 400, json.dumps({'error': str(e)}).encode('utf-8')
+        return 200, df.to_json(orient='split', date_format='iso').encode('utf-8')
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.answer(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        print(f"Serving {self.store.path_data} on {self.url}")
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def read_remote(url, name, columns=None, start=None, end=None):
+    """
+    Reads a slice of a frame from a ProjectionServer at `url` (e.g. 'http://127.0.0.1:8050').
+    Same arguments as ProjectionStore.frame.
+    """
+    params = {key: value for key, value in
+              {'columns': ','.join(columns) if columns else None, 'start': start, 'end': end}.items()
+              if value is not None}
+    with urlopen(f"{url}/frames/{name}?{urlencode(params)}") as response:
+        return pd.read_json(StringIO(response.read().decode('utf-8')), orient='split')
+
+
+def serve(path_data, host='127.0.0.1', port=8050, check_interval=1.0):
+    """
+    Serves the processed and interim layers of `path_data` until interrupted.
+    """
+    ProjectionServer(ProjectionStore(path_data, check_interval), host, port).serve_forever()
@@ -0,0 +1,178 @@
+# Storage backend shared by the raw, interim and processed data layers
+# Frames are saved as columnar Arrow (Feather v2) or Parquet files when pyarrow is available,
+# which allows reading only some columns and date ranges, and memory-mapped reads.
+# Pickle remains available as a fallback backend and for files written before the switch.
+# Frames with a registered schema (schema.SCHEMAS, keyed by file name) are converted to their
+# compact dtypes when saved and when loaded.
+# Import libraries
+import warnings
+import os
+import threading
+import pandas as pd
+import schema
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+warnings.filterwarnings("ignore")
+
+EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet', 'pickle': '.pkl'}
+
+# Backend used for new files: 'arrow' (uncompressed Feather v2, zero-copy when memory-mapped),
+# 'parquet' (compressed, smaller on disk) or 'pickle'
+BACKEND = os.environ.get('ECONOMICETL_STORAGE', 'arrow' if pa is not None else 'pickle')
+
+
+def set_backend(backend):
+    """
+    Selects the backend used by save_frame: 'arrow', 'parquet' or 'pickle'.
+    """
+    global BACKEND
+    if backend not in EXTENSIONS:
+        raise ValueError(f"Unknown storage backend '{backend}'. Options: {sorted(EXTENSIONS)}")
+    if backend != 'pickle' and pa is None:
+        raise ImportError(f"The '{backend}' backend requires pyarrow.")
+    BACKEND = backend
+
+
+def _strip_extension(path):
+    root, ext = os.path.splitext(path)
+    return root if ext in EXTENSIONS.values() else path
+
+
+def find_frame(path):
+    """
+    Returns the file holding the frame saved under `path` (given with or without extension),
+    preferring the current backend, or None when no such file exists.
+    """
+    base = _strip_extension(path)
+    order = [BACKEND] + [backend for backend in EXTENSIONS if backend != BACKEND]
+    for backend in order:
+        candidate = base + EXTENSIONS[backend]
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+
+def save_frame(df, path, backend=None):
+    """
+    Saves `df` under `path` (extension optional) with the selected backend.
+    The file is written to a temporary name and moved into place, so readers never see
+    a half-written file. Copies left by other backends are removed.
+
+    Parameters:
+    - df (pd.DataFrame): Frame to save. The index is stored alongside the columns.
+      Frames with a registered schema are converted to it first.
+    - path (str): Destination, e.g. f'{path_data}/raw/ibge-gdp-quarterly'.
+    - backend (str): Overrides the module-level BACKEND.
+
+    Returns:
+    - str with the path of the written file.
+    """
+    backend = backend or BACKEND
+    base = _strip_extension(path)
+    target = base + EXTENSIONS[backend]
+    df = schema.conform(df, os.path.basename(base))
+    tmp = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+
+    if backend == 'pickle':
+        df.to_pickle(tmp)
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        if backend == 'arrow':
+            feather.write_feather(table, tmp, compression='uncompressed')
+        else:
+            pq.write_table(table, tmp)
+    os.replace(tmp, target)
+
+    for other in EXTENSIONS.values():
+        if base + other != target and os.path.exists(base + other):
+            os.remove(base + other)
+    return target
+
+
+def _index_columns(file_schema):
+    metadata = file_schema.pandas_metadata or {}
+    return [name for name in metadata.get('index_columns', []) if isinstance(name, str)]
+
+
+def _slice_index(df, start, end, path):
+    """
+    Keeps the rows of `df` whose date index lies between `start` and `end` (inclusive).
+    """
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError(f"The frame saved under '{path}' has no date index; start/end cannot be applied.")
+    if start is not None:
+        df = df[df.index >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df.index <= pd.Timestamp(end)]
+    return df
+
+
+def load_frame(path, columns=None, start=None, end=None, memory_map=True):
+    """
+    Loads the frame saved under `path` (extension optional).
+
+    Parameters:
+    - path (str): Location used with save_frame, e.g. f'{path_data}/raw/ibge-gdp-quarterly'.
+    - columns (list): Columns to read. Only these are read from columnar files.
+    - start, end: Inclusive bounds on the index (dates), applied before conversion to pandas
+      when the index is stored as a column, and to the loaded frame otherwise.
+    - memory_map (bool): Memory-map columnar files instead of reading them into memory.
+
+    Returns:
+    - pd.DataFrame, converted to its registered schema if it has one.
+
+    Raises:
+    - FileNotFoundError when nothing was saved under `path`.
+    - ValueError when start or end is given for a frame without a date index.
+    """
+    found = find_frame(path)
+    if found is None:
+        raise FileNotFoundError(f"No stored frame found for '{path}'.")
+    name = os.path.basename(_strip_extension(found))
+
+    if found.endswith(EXTENSIONS['pickle']):
+        df = pd.read_pickle(found)
+        if columns is not None:
+            df = df[list(columns)]
+        if start is not None or end is not None:
+            df = _slice_index(df, start, end, found)
+        return schema.conform(df, name)
+
+    # Only the schema: the footer of the file, whatever memory_map is
+    if found.endswith(EXTENSIONS['arrow']):
+        with pa.memory_map(found) as source:
+            file_schema = pa.ipc.open_file(source).schema
+    else:
+        file_schema = pq.read_schema(found, memory_map=True)
+    index_columns = _index_columns(file_schema)
+    read_columns = None if columns is None else index_columns + [c for c in columns if c not in index_columns]
+
+    if found.endswith(EXTENSIONS['arrow']):
+        table = feather.read_table(found, columns=read_columns, memory_map=memory_map)
+    else:
+        table = pq.read_table(found, columns=read_columns, memory_map=memory_map)
+
+    if index_columns and (start is not None or end is not None):
+        key = table.column(index_columns[0])
+        if not pa.types.is_timestamp(key.type):
+            raise ValueError(f"The frame saved under '{found}' has no date index; start/end cannot be applied.")
+        mask = None
+        if start is not None:
+            mask = pc.greater_equal(key, pa.scalar(pd.Timestamp(start), type=key.type))
+        if end is not None:
+            upper = pc.less_equal(key, pa.scalar(pd.Timestamp(end), type=key.type))
+            mask = upper if mask is None else pc.and_(mask, upper)
+        table = table.filter(mask)
+
+    # Keep the pandas metadata so the index is rebuilt even when only some columns were read
+    df = table.replace_schema_metadata(file_schema.metadata).to_pandas()
+    if not index_columns and (start is not None or end is not None):
+        df = _slice_index(df, start, end, found)
+    return schema.conform(df, name)
@@ -0,0 +1,208 @@
+# Structured telemetry of pipeline runs
+# Every extraction, projection and assembly step is recorded with its wall time, network bytes,
+# requests, retries, cache hits, output rows and peak memory, as one JSON line per stage
+# Import libraries
+import warnings
+import os
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+warnings.filterwarnings("ignore")
+
+# Counters kept for every stage; extractors add to them with count()
+COUNTERS = ('requests', 'bytes', 'retries', 'cache_hits', 'not_modified')
+
+_local = threading.local()
+# Counters of one stage may be updated from the worker threads it starts (see propagate)
+_count_lock = threading.Lock()
+
+
+def _rows(output):
+    if isinstance(output, dict):
+        return sum(_rows(value) for value in output.values())
+    try:
+        return len(output)
+    except TypeError:
+        return None
+
+
+class RunReport:
+    """
+    Collects one record per stage and appends it to a JSON lines file as soon as the stage ends.
+
+    Parameters:
+    - path (str): JSON lines file. Records are only kept in memory when None.
+    - profile_dir (str): When given, every stage is run under cProfile and its statistics are
+      dumped to {profile_dir}/{stage}.prof.
+    - memory (bool): Track the peak memory allocated during each stage (tracemalloc).
+      Stages running at the same time share their peak. Off by default: tracing slows down
+      every allocation of the run.
+    """
+
+    def __init__(self, path=None, profile_dir=None, memory=False):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.memory = memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._active = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        # Tracing started by the caller is left running when the report is disabled
+        self.started_tracing = bool(memory) and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    def write(self, record):
+        """
+        Appends `record` (a JSON-serializable dict) to the report.
+        """
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record, default=str) + '\n')
+
+    def _enter_memory(self):
+        with self._lock:
+            if self._active == 0:
+                tracemalloc.reset_peak()
+            self._active += 1
+            return tracemalloc.get_traced_memory()[0]
+
+    def _exit_memory(self, baseline):
+        with self._lock:
+            self._active -= 1
+            return max(tracemalloc.get_traced_memory()[1] - baseline, 0)
+
+    @contextmanager
+    def stage(self, name, kind):
+        """
+        Records the stage run inside the block. Set record['rows'] (or call set_output) to report
+        the size of its output; exceptions are recorded and re-raised.
+        """
+        record = {'stage': name, 'kind': kind, 'started': time.time(), 'status': 'ok', 'rows': None,
+                  **dict.fromkeys(COUNTERS, 0)}
+        outer = getattr(_local, 'record', None)
+        _local.record = record
+        baseline = self._enter_memory() if self.memory and tracemalloc.is_tracing() else None
+        profiler = None
+        if self.profile_dir:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # another profiler is already active in this thread
+                profiler = None
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record.update(status='failed', error=f'{type(e).__name__}: {e}')
+            raise
+        finally:
+            record['seconds'] = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                record['profile'] = os.path.join(self.profile_dir, f'{name}.prof')
+                profiler.dump_stats(record['profile'])
+            if baseline is not None:
+                record['peak_memory_bytes'] = self._exit_memory(baseline)
+            _local.record = outer
+            self.write(record)
+
+
+REPORT = None
+
+
+def configure(path=None, profile_dir=None, memory=False):
+    """
+    Replaces the module-level report used by the pipeline. Returns the new RunReport.
+    """
+    global REPORT
+    _stop_tracing(REPORT)
+    REPORT = RunReport(path, profile_dir, memory)
+    return REPORT
+
+
+def _stop_tracing(report):
+    if report is not None and report.started_tracing and tracemalloc.is_tracing():
+        tracemalloc.stop()
+        report.started_tracing = False
+
+
+def disable():
+    """
+    Stops recording; stage() becomes a no-op. Memory tracing is stopped only if the report started it.
+    """
+    global REPORT
+    _stop_tracing(REPORT)
+    REPORT = None
+
+
+@contextmanager
+def stage(name, kind):
+    """
+    Records a stage in the module-level report. Does nothing when telemetry is not configured.
+    """
+    if REPORT is None:
+        yield {}
+        return
+    with REPORT.stage(name, kind) as record:
+        yield record
+
+
+def set_output(record, output):
+    """
+    Stores the number of rows of `output` (a frame or a dict of frames) in a stage record.
+    """
+    record['rows'] = _rows(output)
+
+
+def active():
+    """
+    Whether a stage is being recorded in the current thread, i.e. whether count() has any effect.
+    """
+    return getattr(_local, 'record', None) is not None
+
+
+def count(counter, n=1):
+    """
+    Adds `n` to a counter of the stage running in the current thread, if any.
+    """
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        with _count_lock:
+            record[counter] = record.get(counter, 0) + n
+
+
+def propagate(func):
+    """
+    Wraps `func` so that, when called from a worker thread, its counts go to the stage that was
+    running in the current thread when propagate was called.
+    """
+    record = getattr(_local, 'record', None)
+    if record is None:
+        return func
+
+    def wrapper(*args, **kwargs):
+        outer = getattr(_local, 'record', None)
+        _local.record = record
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.record = outer
+    return wrapper
+
+
+def event(name, **fields):
+    """
+    Writes a one-off record (e.g. a failed attempt) to the module-level report.
+    """
+    if REPORT is not None:
+        REPORT.write({'event': name, 'time': time.time(), **fields})